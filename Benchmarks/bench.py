@@ -0,0 +1,162 @@
+import argparse
+import json, os, sys
+import shutil, socket, sqlite3, subprocess, tempfile
+import time
+import urllib.request
+
+if __name__ == '__main__':
+    #-----------------------------
+    # End-to-end benchmarks of mainargparse.py against the local FR24 stand-in
+    #-----------------------------
+    # python3 Benchmarks/bench.py
+    # python3 Benchmarks/bench.py -w 1 4 --latency 0.05 --json results.json
+    #
+    # Every run uses a fresh copy of the program in a temporary folder, so nothing is cached
+    BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+    WORKING_DIR = os.path.dirname(BENCH_DIR)
+    MOCK_FILE = os.path.join(BENCH_DIR, 'mock_fr24.py')
+    FIRST_HEX_ID = 0x30000000
+    REGS = ['B-16340', 'B-16701', 'B-18901']
+    SCENARIOS = ['r1', 'r3', 'r4', 'r5', 'render']
+
+    parser = argparse.ArgumentParser(description='Benchmarks of mainargparse.py on a local FR24 stand-in')
+    parser.add_argument('-s', '--scenarios', action='store', dest='scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('-w', '--workers', action='store', dest='workers', nargs='+', type=int, default=[1, 4], help='worker counts to run each scenario with')
+    parser.add_argument('--flights', action='store', dest='flights', type=int, default=120, help='HEX IDs of -r3 and -r4')
+    parser.add_argument('--points', action='store', dest='points', type=int, default=1000, help='track points of a flight')
+    parser.add_argument('--page-size', action='store', dest='page_size', type=int, default=20)
+    parser.add_argument('--pages', action='store', dest='pages', type=int, default=3)
+    parser.add_argument('--latency', action='store', dest='latency', type=float, default=0.02, help='seconds of latency of the server')
+    parser.add_argument('--error-402', action='store', dest='error_402', type=float, default=0.0)
+    parser.add_argument('--error-520', action='store', dest='error_520', type=float, default=0.0)
+    parser.add_argument('--fixtures', action='store', dest='fixtures', metavar='DIR', help='serve recorded responses instead of synthetic ones')
+    parser.add_argument('--args', action='store', dest='extra_args', default='', help='more arguments to every run, eg. "--json json"')
+    parser.add_argument('--json', action='store', dest='json_file', metavar='FILE', help='also save the results to FILE')
+    arg_dict = vars(parser.parse_args())
+
+    def free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def server_stats(port: int) -> dict:
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/stats') as r:
+            return json.load(r)
+
+    # Start the stand-in server, and wait until it answers
+    def start_server(port: int) -> subprocess.Popen:
+        command = [sys.executable, MOCK_FILE, '--port', str(port), '--points', str(arg_dict['points'])
+                   , '--regs', ','.join(REGS), '--page-size', str(arg_dict['page_size']), '--pages', str(arg_dict['pages'])
+                   , '--latency', str(arg_dict['latency']), '--error-402', str(arg_dict['error_402']), '--error-520', str(arg_dict['error_520'])
+                   , '--seed', '0']
+        if arg_dict['fixtures']:
+            command += ['--fixtures', arg_dict['fixtures']]
+        server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                server_stats(port)
+                return server
+            except OSError:
+                time.sleep(0.05)
+        server.kill()
+        raise RuntimeError('mock server did not start')
+
+    # A fresh copy of the program in a temporary folder
+    def prepare_dir() -> str:
+        run_dir = tempfile.mkdtemp(prefix='fr24_bench_')
+        shutil.copy(os.path.join(WORKING_DIR, 'mainargparse.py'), run_dir)
+        shutil.copytree(os.path.join(WORKING_DIR, 'Templates'), os.path.join(run_dir, 'Templates'))
+        with open(os.path.join(run_dir, 'fleet_list.txt'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(REGS))
+        return run_dir
+
+    # Run the program once, returns seconds and peak memory in MB of its main process
+    def run(run_dir: str, args: list[str], port: int):
+        command = [sys.executable, os.path.join(run_dir, 'mainargparse.py')] + args
+        command += ['--api-base', f'http://127.0.0.1:{port}', '--rate', '1000', '--max-rate', '1000', '-nh'] + arg_dict['extra_args'].split()
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, cwd=run_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if hasattr(os, 'wait4'):
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in KB on Linux, in bytes on macOS
+            peak_mb = rusage.ru_maxrss / (1<<20 if sys.platform == 'darwin' else 1<<10)
+        else:
+            process.wait()
+            peak_mb = float('nan')
+        elapsed = time.perf_counter() - start_time
+        if process.returncode != 0:
+            print(f'  warning: {" ".join(args)} exited with {process.returncode}')
+        return elapsed, peak_mb
+
+    def count_outputs(run_dir: str, folder: str) -> int:
+        return sum(len(files) for root, dirs, files in os.walk(os.path.join(run_dir, folder)))
+
+    # Track points in the GPX outputs, recorded fixtures have any number of points
+    def count_track_points(run_dir: str) -> int:
+        n_points = 0
+        for root, dirs, files in os.walk(os.path.join(run_dir, 'GPXs')):
+            for filename in files:
+                with open(os.path.join(root, filename), 'r', encoding='utf-8') as f:
+                    n_points += f.read().count('<trkpt ')
+        return n_points
+
+    def count_summaries(run_dir: str) -> int:
+        db_file = os.path.join(run_dir, 'HEXs', 'summaries.db')
+        if not os.path.exists(db_file):
+            return 0
+        with sqlite3.connect(db_file) as db:
+            return db.execute('SELECT COUNT(*) FROM summaries').fetchone()[0]
+
+    hex_ids = [f'{FIRST_HEX_ID + i:08X}' for i in range(arg_dict['flights'])]
+    scenario_args = {
+        'r1': ['-r1', REGS[0]],
+        'r3': ['-r3'] + hex_ids,
+        'r4': ['-r4', hex_ids[0], f'{FIRST_HEX_ID + arg_dict["flights"]:08X}'],
+        'r5': ['-r5'],
+        }
+
+    port = free_port()
+    server = start_server(port)
+    results = []
+    try:
+        print(f'{"run":12s} {"workers":>7s} {"seconds":>8s} {"flights":>7s} {"flights/s":>9s} {"requests":>8s} {"peak MB":>8s}')
+        for scenario in arg_dict['scenarios']:
+            for workers in arg_dict['workers']:
+                if scenario == 'render':
+                    # Fetch once, then render again from the saved responses, without the startup time
+                    run_dir = prepare_dir()
+                    run(run_dir, scenario_args['r3'] + ['-w', '4'], port)
+                    startup, _ = run(run_dir, ['-r6', 'NO_SUCH_REG'], port)
+                    n_flights = count_outputs(run_dir, 'KMLs')
+                    n_points = count_track_points(run_dir)
+                    for name, option in [('render kml', '-ng'), ('render gpx', '-nk')]:
+                        shutil.rmtree(os.path.join(run_dir, 'KMLs'), ignore_errors=True)
+                        shutil.rmtree(os.path.join(run_dir, 'GPXs'), ignore_errors=True)
+                        elapsed, peak_mb = run(run_dir, ['-r6', option, '-w', str(workers)], port)
+                        render_time = max(elapsed - startup, 1e-9)
+                        ms_per_1k_points = render_time * 1000 / max(n_points / 1000, 1e-9)
+                        results.append({'run': name, 'workers': workers, 'seconds': elapsed, 'flights': n_flights, 'points': n_points
+                                        , 'ms_per_1k_points': ms_per_1k_points, 'peak_mb': peak_mb})
+                        print(f'{name:12s} {workers:7d} {elapsed:8.2f} {n_flights:7d} {n_flights/render_time:9.1f} {"-":>8s} {peak_mb:8.1f}  {ms_per_1k_points:.2f} ms per 1k points')
+                    shutil.rmtree(run_dir, ignore_errors=True)
+                    continue
+
+                run_dir = prepare_dir()
+                stats_before = server_stats(port)
+                elapsed, peak_mb = run(run_dir, scenario_args[scenario] + ['-w', str(workers)], port)
+                stats_after = server_stats(port)
+                n_requests = sum(stats_after.values()) - sum(stats_before.values())
+                # -r5 only lists flights, the others fetch them
+                n_flights = count_summaries(run_dir) if scenario == 'r5' else count_outputs(run_dir, 'KMLs')
+                results.append({'run': scenario, 'workers': workers, 'seconds': elapsed, 'flights': n_flights, 'requests': n_requests
+                                , 'flights_per_second': n_flights / elapsed, 'peak_mb': peak_mb})
+                print(f'{scenario:12s} {workers:7d} {elapsed:8.2f} {n_flights:7d} {n_flights/elapsed:9.1f} {n_requests:8d} {peak_mb:8.1f}')
+                shutil.rmtree(run_dir, ignore_errors=True)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if arg_dict['json_file']:
+        with open(arg_dict['json_file'], 'w', encoding='utf-8') as f:
+            json.dump({'options': arg_dict, 'results': results}, f, indent=2)
@@ -0,0 +1,65 @@
+import argparse
+import glob, gzip, os
+import json
+import time
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if __name__ == '__main__':
+    #-----------------------------
+    # Micro-benchmark of json parsers on captured responses
+    #-----------------------------
+    # python3 Benchmarks/bench_json.py [RESPONSE_FILE ...]
+    # By default, all saved flights in "Responses" are used
+    WORKING_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    DEFAULT_PATTERNS = [os.path.join(WORKING_DIR, 'Responses', '*', '*.json'), os.path.join(WORKING_DIR, 'Responses', '*', '*.json.gz')]
+
+    parser = argparse.ArgumentParser(description='Compare json parsers on captured FR24 responses')
+    parser.add_argument('files', metavar='RESPONSE_FILE', nargs='*', help='captured responses, .json or .json.gz')
+    parser.add_argument('-n', '--repeat', action='store', dest='repeat', type=int, default=5, help='times to parse every file')
+    arg_dict = vars(parser.parse_args())
+
+    files = arg_dict['files'] or sorted(file for pattern in DEFAULT_PATTERNS for file in glob.glob(pattern))
+    files = [file for file in files if not os.path.basename(file).startswith('List_')]
+    if not files:
+        print('No responses found, run some flights first or give the files')
+        exit()
+
+    # Keep every response in memory as raw bytes, like r.content
+    contents: list[bytes] = []
+    for file in files:
+        if file.endswith('.gz'):
+            with gzip.open(file, 'rb') as f:
+                contents.append(f.read())
+        else:
+            with open(file, 'rb') as f:
+                contents.append(f.read())
+    total_bytes = sum(len(content) for content in contents) * arg_dict['repeat']
+
+    # The old path decodes to str first, like r.text
+    parsers = {
+        'json (str)': lambda content: json.loads(content.decode('utf-8')),
+        'json (bytes)': json.loads,
+        }
+    if orjson is not None:
+        parsers['orjson'] = orjson.loads
+    if msgspec is not None:
+        parsers['msgspec'] = msgspec.json.decode
+
+    print(f'{len(contents)} responses, {total_bytes/arg_dict["repeat"]/1e6:.1f} MB, parsed {arg_dict["repeat"]} times')
+    baseline = None
+    for name, loads in parsers.items():
+        start_time = time.perf_counter()
+        for _ in range(arg_dict['repeat']):
+            for content in contents:
+                loads(content)['result']['response']['data']['flight']['track']
+        elapsed = time.perf_counter() - start_time
+        if baseline is None:
+            baseline = elapsed
+        print(f'  {name:14s} {elapsed:8.3f}s {total_bytes/elapsed/1e6:8.1f} MB/s  x{baseline/elapsed:.2f}')
@@ -0,0 +1,205 @@
+import argparse
+import gzip, json, os
+import functools, math, random
+import threading, time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+if __name__ == '__main__':
+    #-----------------------------
+    # A local stand-in of the FR24 API, for benchmarks and testing
+    #-----------------------------
+    # python3 Benchmarks/mock_fr24.py --port 8024 --latency 0.05 --error-402 0.1
+    # python3 mainargparse.py -r3 30000001 --api-base http://127.0.0.1:8024
+    #
+    # Flights are synthetic, or recorded ones from a "Responses" folder with --fixtures
+    # Synthetic flight HEX IDs start from FIRST_HEX_ID, and are shared between the regs in turn
+    FIRST_HEX_ID = 0x30000000
+    FIRST_TIMESTAMP = 1690000000
+    HEX_ID_SECONDS = 7
+
+    parser = argparse.ArgumentParser(description='A local FR24 stand-in server')
+    parser.add_argument('--port', action='store', dest='port', type=int, default=8024)
+    parser.add_argument('--latency', action='store', dest='latency', type=float, default=0.0, help='seconds before every reply')
+    parser.add_argument('--jitter', action='store', dest='jitter', type=float, default=0.0, help='random extra seconds before every reply')
+    parser.add_argument('--error-402', action='store', dest='error_402', type=float, default=0.0, help='part of requests replied with 402')
+    parser.add_argument('--error-520', action='store', dest='error_520', type=float, default=0.0, help='part of requests replied with 520')
+    parser.add_argument('--stall', action='store', dest='stall', type=float, default=0.0, help='part of requests never replied, to test timeouts')
+    parser.add_argument('--no-gzip', action='store_false', dest='gzip', help='never compress replies, even if the client accepts gzip')
+    parser.add_argument('--regs', action='store', dest='regs', default='B-16340,B-16701,B-18901', help='regs of synthetic flights, comma separated')
+    parser.add_argument('--page-size', action='store', dest='page_size', type=int, default=100, help='flights in a list page')
+    parser.add_argument('--pages', action='store', dest='pages', type=int, default=3, help='list pages of every reg')
+    parser.add_argument('--points', action='store', dest='points', type=int, default=1000, help='track points of a synthetic flight')
+    parser.add_argument('--missing-every', action='store', dest='missing_every', type=int, default=3, help='every Nth HEX ID is not a flight, 0 for none')
+    parser.add_argument('--fixtures', action='store', dest='fixtures', metavar='DIR', help='serve recorded responses in DIR, eg. a "Responses" folder')
+    parser.add_argument('--seed', action='store', dest='seed', type=int, default=None)
+    arg_dict = vars(parser.parse_args())
+
+    regs: list[str] = arg_dict['regs'].split(',')
+    random.seed(arg_dict['seed'])
+
+    # Requests served, by kind, at /stats
+    stats = {'list': 0, 'playback': 0, '402': 0, '520': 0, 'stalled': 0, 'other': 0}
+    bytes_sent = {'bytes': 0}
+    stats_lock = threading.Lock()
+
+    # Recorded responses, by (reg, page) and by lower case HEX ID
+    list_fixtures: dict[tuple, str] = {}
+    playback_fixtures: dict[str, str] = {}
+    if arg_dict['fixtures']:
+        for root, dirs, files in os.walk(arg_dict['fixtures']):
+            for filename in files:
+                name = filename.removesuffix('.gz').removesuffix('.json')
+                if not filename.endswith(('.json', '.json.gz')):
+                    continue
+                if name.startswith('List_'):
+                    reg, page = name[len('List_'):].rsplit('_', 1)
+                    list_fixtures[(reg, int(page))] = os.path.join(root, filename)
+                else:
+                    playback_fixtures[name.rsplit('_', 1)[-1].lower()] = os.path.join(root, filename)
+        print(f'{len(playback_fixtures)} flights, {len(list_fixtures)} list pages recorded')
+
+    def read_fixture(file: str) -> bytes:
+        if file.endswith('.gz'):
+            with gzip.open(file, 'rb') as f:
+                return f.read()
+        with open(file, 'rb') as f:
+            return f.read()
+
+    # Missing HEX IDs are scattered by a hash, so every reg has some flights
+    def is_flight(hex_num: int) -> bool:
+        return not (arg_dict['missing_every'] and (hex_num * 2654435761 >> 8) % arg_dict['missing_every'] == 0)
+
+    # A synthetic flight: climb, cruise and descend, heading east
+    @functools.lru_cache(maxsize=4096)
+    def synthetic_playback(hex_num: int) -> bytes:
+        if not is_flight(hex_num):
+            return json.dumps({'result': {'response': {'data': None}}}).encode('utf-8')
+        reg = regs[(hex_num - FIRST_HEX_ID) % len(regs)]
+        start = FIRST_TIMESTAMP + (hex_num - FIRST_HEX_ID) * HEX_ID_SECONDS
+        n_points = arg_dict['points']
+        track = []
+        for i in range(n_points):
+            altitude_feet = int(35000 * min(1.0, 4 * min(i, n_points - 1 - i) / max(n_points, 1)))
+            track.append({
+                'latitude': round(25.08 + 0.01 * i + 0.002 * math.sin(i / 10), 6),
+                'longitude': round(121.23 + 0.013 * i, 6),
+                'altitude': {'feet': altitude_feet, 'meters': int(altitude_feet * 0.3048)},
+                'speed': {'kmh': 800.0, 'kts': 432, 'mph': 497.1},
+                'verticalSpeed': {'fpm': 0, 'ms': 0},
+                'heading': 90,
+                'squawk': '0000',
+                'timestamp': start + 10 * i,
+                'ems': None
+                })
+        flight = {
+            'identification': {'id': f'{hex_num:08x}', 'number': {'default': f'BR{hex_num % 900}'}, 'callsign': f'EVA{hex_num % 900}'},
+            'aircraft': {'identification': {'registration': reg}},
+            'status': {'generic': {'status': {'text': 'landed'}, 'eventTime': {'utc': start + 10 * n_points}}},
+            'airport': {'origin': {'code': {'iata': 'TPE'}}, 'destination': {'timezone': {'offset': 28800}}},
+            'track': track
+            }
+        return json.dumps({'result': {'response': {'data': {'flight': flight}}}}).encode('utf-8')
+
+    # A synthetic list page, newest flights first, page 1 ends at the newest HEX ID of the reg
+    def synthetic_list(reg: str, page: int) -> bytes:
+        if reg not in regs:
+            return json.dumps({'result': {'response': {'data': None}}}).encode('utf-8')
+        newest = arg_dict['page_size'] * arg_dict['pages'] - 1
+        data = []
+        for j in range((page - 1) * arg_dict['page_size'], min(page * arg_dict['page_size'], newest + 1)):
+            hex_num = FIRST_HEX_ID + (newest - j) * len(regs) + regs.index(reg)
+            if not is_flight(hex_num):
+                continue
+            departure = FIRST_TIMESTAMP + (hex_num - FIRST_HEX_ID) * HEX_ID_SECONDS
+            data.append({
+                'identification': {'id': f'{hex_num:08x}', 'number': {'default': f'BR{hex_num % 900}'}, 'callsign': f'EVA{hex_num % 900}'},
+                'time': {'scheduled': {'departure': departure}, 'real': {'departure': departure + 600}},
+                'airport': {'origin': {'code': {'iata': 'TPE'}}, 'destination': {'code': {'iata': 'NRT'}}, 'real': None}
+                })
+        return json.dumps({'result': {'response': {'data': data, 'page': {'current': page, 'more': page < arg_dict['pages']}}}}).encode('utf-8')
+
+    def list_response(reg: str, page: int) -> bytes:
+        if not arg_dict['fixtures']:
+            return synthetic_list(reg, page)
+        if (reg, page) in list_fixtures:
+            return read_fixture(list_fixtures[(reg, page)])
+        return json.dumps({'result': {'response': {'data': None}}}).encode('utf-8')
+
+    def playback_response(flight_id: str) -> bytes:
+        if not arg_dict['fixtures']:
+            return synthetic_playback(int(flight_id, 16))
+        if flight_id.lower() in playback_fixtures:
+            return read_fixture(playback_fixtures[flight_id.lower()])
+        return json.dumps({'result': {'response': {'data': None}}}).encode('utf-8')
+
+    class FR24_Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def reply(self, status: int, body: bytes = b''):
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if body and arg_dict['gzip'] and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body, compresslevel=5)
+                self.send_header('Content-Encoding', 'gzip')
+            with stats_lock:
+                bytes_sent['bytes'] += len(body)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def count(self, kind: str):
+            with stats_lock:
+                stats[kind] += 1
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/stats':
+                with stats_lock:
+                    body = json.dumps(stats).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if url.path == '/bytes':
+                with stats_lock:
+                    body = json.dumps(bytes_sent).encode('utf-8')
+                return self.reply(200, body)
+
+            if arg_dict['latency'] or arg_dict['jitter']:
+                time.sleep(arg_dict['latency'] + random.random() * arg_dict['jitter'])
+            if random.random() < arg_dict['stall']:
+                self.count('stalled')
+                time.sleep(3600)
+                return
+            roll = random.random()
+            if roll < arg_dict['error_402']:
+                self.count('402')
+                return self.reply(402)
+            if roll < arg_dict['error_402'] + arg_dict['error_520']:
+                self.count('520')
+                return self.reply(520)
+
+            try:
+                if url.path.endswith('/flight/list.json'):
+                    self.count('list')
+                    return self.reply(200, list_response(query['query'][0], int(query.get('page', ['1'])[0])))
+                if url.path.endswith('/flight-playback.json'):
+                    self.count('playback')
+                    return self.reply(200, playback_response(query['flightId'][0]))
+            except (KeyError, ValueError):
+                pass
+            self.count('other')
+            self.reply(404)
+
+    server = ThreadingHTTPServer(('127.0.0.1', arg_dict['port']), FR24_Handler)
+    server.daemon_threads = True
+    print(f'Serving on http://127.0.0.1:{arg_dict["port"]}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
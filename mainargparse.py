@@ -1,8 +1,53 @@
 import requests
-import os
+import os, sys
 import argparse, textwrap
 import json
 import datetime, time
+import functools, itertools, contextlib, hashlib
+import shutil
+import bisect, re
+import sqlite3, glob, socket, subprocess
+import array, math
+import threading, concurrent.futures, multiprocessing, queue, asyncio
+import random
+import atexit, cProfile, pstats
+import gzip, zipfile, io
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import httpx
+except ImportError:
+    httpx = None
+try:
+    import h2
+except ImportError:
+    h2 = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+try:
+    import numpy
+except ImportError:
+    numpy = None
 #-----------------------------
 # Flags
 #-----------------------------
@@ -22,13 +67,20 @@ if __name__ == '__main__':
 
     RESPONSE_DIR = os.path.join(WORKING_DIR, 'Responses')
     RESPONSE_ERROR_DIR = os.path.join(WORKING_DIR, 'Responses_Error')
+    RESPONSE_INDEX_FILE = os.path.join(RESPONSE_DIR, 'cache_index.jsonl')
+    OUTPUT_MANIFEST_FILE = os.path.join(WORKING_DIR, 'output_manifest.jsonl')
     HEADERS_FILE = os.path.join(WORKING_DIR, 'Templates', 'headers.json')
 
     FR24_HEX_DATE_FILE = os.path.join(WORKING_DIR, 'fr24_hex_date.csv')
     FLEET_LIST_FILE = os.path.join(WORKING_DIR, 'fleet_list.txt')
+    SUMMARY_DB_FILE = os.path.join(WORKING_DIR, 'HEXs', 'summaries.db')
     COOKIE_FILE = os.path.join(WORKING_DIR, 'cookie.txt')
     TOKEN_FILE = os.path.join(WORKING_DIR, 'token.txt')
     
+    CHECKPOINT_DIR = os.path.join(WORKING_DIR, 'Checkpoints')
+    PROBE_CACHE_DIR = os.path.join(WORKING_DIR, 'Probes')
+    AGGREGATE_DIR = os.path.join(WORKING_DIR, 'Aggregates')
+
     HEX_DIR = os.path.join(WORKING_DIR, 'HEXs')
     if not os.path.exists(HEX_DIR):
         os.makedirs(HEX_DIR)
@@ -40,6 +92,20 @@ if __name__ == '__main__':
     GPX_TEMPLATE_FILE = os.path.join(WORKING_DIR, 'Templates', 'gpx_template.xml')
     with open (GPX_TEMPLATE_FILE, 'r', encoding='utf-8') as f:
         GPX_TEMPLATE = ''.join(f.readlines())
+
+    # Templates are written around the track points, which are streamed in between
+    KML_TEMPLATE_HEAD, KML_TEMPLATE_TAIL = KML_TEMPLATE.split('[COORDS]', 1)
+    GPX_TEMPLATE_HEAD, GPX_TEMPLATE_TAIL = GPX_TEMPLATE.split('[COORDS]', 1)
+
+    # Split a template into the part before the element <tag>, the element itself, and the part after
+    def split_template(template: str, tag: str):
+        start = template.rfind('\n', 0, template.index(f'<{tag}>')) + 1
+        end = template.index('\n', template.index(f'</{tag}>')) + 1
+        return template[:start], template[start:end], template[end:]
+
+    # Aggregate documents repeat the Placemark/trk of the templates once per flight
+    KML_AGGREGATE_HEAD, KML_AGGREGATE_FLIGHT, KML_AGGREGATE_TAIL = split_template(KML_TEMPLATE, 'Placemark')
+    GPX_AGGREGATE_HEAD, GPX_AGGREGATE_FLIGHT, GPX_AGGREGATE_TAIL = split_template(GPX_TEMPLATE, 'trk')
     
     HELP_TEXT_FILE = os.path.join(WORKING_DIR, 'Templates', 'help.txt')
     with open(HELP_TEXT_FILE, 'r', encoding='utf-8') as f:
@@ -48,19 +114,347 @@ if __name__ == '__main__':
     #-----------------------------
     # Constants
     #-----------------------------
-    REG_URL_TEMPLATE = 'https://api.flightradar24.com/common/v1/flight/list.json?query=[REG_ID]&fetchBy=reg&limit=100&token=[TOKEN]&page=[PAGE]'
-    FLIGHT_URL_TEMPLATE = 'https://api.flightradar24.com/common/v1/flight-playback.json?flightId=[FLIGHT_ID]&timestamp=[TIMESTAMP]'
+    API_BASE_URL = 'https://api.flightradar24.com'
+    REG_URL_TEMPLATE = '[API_BASE]/common/v1/flight/list.json?query=[REG_ID]&fetchBy=reg&limit=100&token=[TOKEN]&page=[PAGE]'
+    FLIGHT_URL_TEMPLATE = '[API_BASE]/common/v1/flight-playback.json?flightId=[FLIGHT_ID]&timestamp=[TIMESTAMP]'
+
+    # Number of ids tried one by one, when an estimated hex id is not a flight
+    HEX_PROBE_STEPS = 10
+    # Empty ids in a row after which -r8 stops walking past the last known flight, as no newer ids are given out yet
+    WINDOW_WALK_MAX_EMPTY = 100
+
+    # Statuses of a searched flight, as written in -r4 journals
+    FLIGHT_FOUND = 'found'
+    FLIGHT_MISSING = 'missing'
+    FLIGHT_ERROR = 'error'
+    FLIGHT_ABORT = 'abort'
+
+    # A -r4 journal writes a checkpoint after this many finished ids
+    SWEEP_CHECKPOINT_EVERY = 1000
+    # A shard of a -r4 queue is handed out again if its worker has not renewed the lease for this long
+    SHARD_LEASE_SECONDS = 300
+    # Seconds between progress reports of a -r4 queue with --spawn
+    SHARD_PROGRESS_SECONDS = 10
+    # A shard with errors is handed out again after this cool down, up to SHARD_MAX_ATTEMPTS times
+    SHARD_RETRY_SECONDS = 60
+    SHARD_MAX_ATTEMPTS = 5
+    # Changed pages of the probe cache are saved after this many HEX IDs
+    PROBE_CACHE_SAVE_EVERY = 1000
+
+    # For converting degrees of latitude into meters
+    EARTH_METERS_PER_DEGREE = 6371008.8*math.pi/180
+
+    # Smallest climb or descent kept as a top/bottom by --simplify
+    ALTITUDE_INFLECTION_METERS = 100
+
+    # Saved responses, plain or compressed
+    RESPONSE_FILE_EXTENSIONS = ('.json', '.json.gz', '.json.zst')
+
+    # Track points are written in chunks of this many lines
+    WRITE_CHUNK_LINES = 1024
+    WRITE_BUFFER_SIZE = 1 << 16
+    # Rendered text waiting for the writers of --engine pipeline, in characters
+    WRITE_QUEUE_CHARS = 32 << 20
+
+    # Status codes meaning we are sending too many requests
+    THROTTLED_STATUS_CODES = [402, 429, 520]
+    # Transfer encodings the responses could be compressed with, brotli needs the brotli module
+    ACCEPT_ENCODING = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
 
     #-----------------------------
     # Utilities
     #-----------------------------
+    # Parsers of json responses, all take bytes or str
+    # orjson and msgspec parse bytes directly, without decoding to str first
+    JSON_LOADERS = {'json': json.loads}
+    if orjson is not None:
+        JSON_LOADERS['orjson'] = orjson.loads
+    if msgspec is not None:
+        JSON_LOADERS['msgspec'] = msgspec.json.decode
+    JSON_BACKEND_AUTO = 'orjson' if orjson is not None else 'msgspec' if msgspec is not None else 'json'
+    JSON_DECODE_ERRORS = (ValueError, msgspec.DecodeError) if msgspec is not None else (ValueError,)
+    json_loads = JSON_LOADERS[JSON_BACKEND_AUTO]
+
+    # Errors of a connection, not of the server, worth trying again
+    TRANSPORT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)
+    if httpx is not None:
+        TRANSPORT_ERRORS += (httpx.TransportError,)
+
+    # Bytes of a response body as received, before it is decompressed
+    # httpx counts them, urllib3 under requests tells how far it read the connection
+    def wire_bytes(r) -> int:
+        if hasattr(r, 'num_bytes_downloaded'):
+            return r.num_bytes_downloaded
+        raw = getattr(r, 'raw', None)
+        if raw is not None and hasattr(raw, 'tell'):
+            return raw.tell()
+        return int(r.headers.get('Content-Length') or len(r.content))
+
+    # Seconds to cool down before trying a request again, or None if done with it
+    # r is None if the try failed with a transport error
+    def retry_delay(r, error: Exception, attempt: int):
+        if r is None:
+            reason = f'{type(error).__name__}'
+            metrics.add('transport_errors')
+        else:
+            metrics.add('requests')
+            metrics.add('bytes_decoded', len(r.content))
+            metrics.add('bytes_in', wire_bytes(r))
+            if r.status_code not in THROTTLED_STATUS_CODES:
+                rate_limiter.on_success()
+                return None
+            reason = 'Too many requests'
+            metrics.add(f'throttled_{r.status_code}')
+            rate_limiter.on_throttled()
+        if attempt >= rate_limiter.max_retries or not rate_limiter.take_retry():
+            print(f'    {reason}, giving up after {attempt+1} tries')
+            metrics.add('gave_up')
+            return None
+        delay = rate_limiter.backoff(attempt, r.headers.get('Retry-After') if r is not None else None)
+        print(f'    {reason}, cooling down {delay:.1f}s')
+        metrics.add('retries')
+        metrics.add('cooldown_seconds', delay)
+        return delay
+
+    # Throttled requests and transport errors are tried again after a cool down
+    # Returns the last response, or None if the server could not be reached at all
     def multiple_requests(s: requests.Session, url: str, method: str = 'GET', headers: dict = {}):
-        r = s.request(method=method, url=url, headers=headers)
-        while r.status_code in [402, 520]:
-            print('    Too many requests, cooling down')
-            time.sleep(30)
-            r = s.request(method=method, url=url, headers=headers)
-        return r
+        attempt = 0
+        while True:
+            with metrics.timer('rate_limit_wait'):
+                rate_limiter.acquire()
+            r, error = None, None
+            try:
+                with metrics.timer('request'):
+                    r = s.request(method=method, url=url, headers=headers)
+            except TRANSPORT_ERRORS as e:
+                error = e
+            delay = retry_delay(r, error, attempt)
+            if delay is None:
+                return r
+            time.sleep(delay)
+            attempt += 1
+
+    # multiple_requests on an async client, waiting for the rate limiter and cool downs without blocking other requests
+    async def multiple_requests_async(client, url: str, method: str = 'GET', headers: dict = {}):
+        attempt = 0
+        while True:
+            with metrics.timer('rate_limit_wait'):
+                await rate_limiter.acquire_async()
+            r, error = None, None
+            try:
+                with metrics.timer('request'):
+                    r = await client.request(method=method, url=url, headers=headers)
+            except TRANSPORT_ERRORS as e:
+                error = e
+            delay = retry_delay(r, error, attempt)
+            if delay is None:
+                return r
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # Token bucket shared by every HTTP call
+    # The rate goes up a little on every success, and is cut by half when the server complains (AIMD)
+    class Rate_Limiter:
+        def __init__(self, rate: float = 5.0, max_rate: float = 20.0, min_rate: float = 0.1, burst: float = 5,
+                     increase: float = 0.05, decrease: float = 0.5, max_retries: int = 8,
+                     backoff_base: float = 2.0, backoff_max: float = 120.0, retry_ratio: float = 0.2, retry_reserve: float = 20):
+            self.rate = min(rate, max_rate)
+            self.max_rate = max_rate
+            self.min_rate = min_rate
+            self.burst = burst
+            self.increase = increase
+            self.decrease = decrease
+            self.max_retries = max_retries
+            self.backoff_base = backoff_base
+            self.backoff_max = backoff_max
+            # Retry budget: every success earns a fraction of a retry, every retry costs one
+            self.retry_ratio = retry_ratio
+            self.retry_reserve = retry_reserve
+            self.retry_tokens = retry_reserve
+
+            self.tokens = burst
+            self.updated = time.monotonic()
+            self.last_decrease = 0.0
+            self.lock = threading.Lock()
+
+        # Take one token, and return how long to wait before using it
+        def reserve(self) -> float:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                self.tokens -= 1
+                if self.tokens >= 0:
+                    return 0.0
+                return -self.tokens/self.rate
+
+        def acquire(self):
+            delay = self.reserve()
+            if delay > 0:
+                time.sleep(delay)
+
+        async def acquire_async(self):
+            delay = self.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        def on_success(self):
+            with self.lock:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                self.retry_tokens = min(self.retry_reserve, self.retry_tokens + self.retry_ratio)
+
+        def on_throttled(self):
+            with self.lock:
+                now = time.monotonic()
+                # Workers often get throttled together, only cut the rate once per second
+                if now - self.last_decrease < 1.0:
+                    return
+                self.last_decrease = now
+                self.rate = max(self.min_rate, self.rate*self.decrease)
+                self.tokens = min(self.tokens, 0)
+
+        def take_retry(self) -> bool:
+            with self.lock:
+                if self.retry_tokens < 1:
+                    return False
+                self.retry_tokens -= 1
+                return True
+
+        # Exponential backoff with jitter, or what the server asked for
+        def backoff(self, attempt: int, retry_after: str = None) -> float:
+            if retry_after:
+                try:
+                    return min(self.backoff_max, float(retry_after))
+                except ValueError:
+                    pass
+            delay = min(self.backoff_max, self.backoff_base*(2**attempt))
+            return delay/2 + random.uniform(0, delay/2)
+
+    # Timers and counters of each stage, reported with --metrics
+    # Timers keep a histogram of durations, with the same buckets as Prometheus
+    class Metrics:
+        BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+        def __init__(self, enabled: bool = False):
+            self.enabled = enabled
+            self.started = time.perf_counter()
+            self.timers: dict[str, dict] = {}
+            self.counters: dict[str, float] = {}
+            self.lock = threading.Lock()
+
+        def add(self, name: str, value: float = 1):
+            if not self.enabled:
+                return
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+        def observe(self, name: str, seconds: float):
+            if not self.enabled:
+                return
+            with self.lock:
+                timer = self.timers.get(name)
+                if timer is None:
+                    timer = self.timers[name] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'buckets': [0]*len(self.BUCKETS)}
+                timer['count'] += 1
+                timer['sum'] += seconds
+                timer['max'] = max(timer['max'], seconds)
+                timer['buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+        @contextlib.contextmanager
+        def timer(self, name: str):
+            if not self.enabled:
+                yield
+                return
+            start_time = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.observe(name, time.perf_counter() - start_time)
+
+        # Everything recorded since the last take, used to collect metrics from worker processes
+        def take(self) -> dict:
+            with self.lock:
+                state = {'timers': self.timers, 'counters': self.counters}
+                self.timers = {}
+                self.counters = {}
+            return state
+
+        def merge(self, state: dict):
+            with self.lock:
+                for name, value in state['counters'].items():
+                    self.counters[name] = self.counters.get(name, 0) + value
+                for name, other in state['timers'].items():
+                    timer = self.timers.get(name)
+                    if timer is None:
+                        self.timers[name] = other
+                        continue
+                    timer['count'] += other['count']
+                    timer['sum'] += other['sum']
+                    timer['max'] = max(timer['max'], other['max'])
+                    timer['buckets'] = [a + b for a, b in zip(timer['buckets'], other['buckets'])]
+
+        # Estimated quantile of a timer from its buckets
+        def quantile(self, name: str, q: float) -> float:
+            timer = self.timers[name]
+            rank = q*timer['count']
+            seen = 0
+            for bound, count in zip(self.BUCKETS, timer['buckets']):
+                seen += count
+                if seen >= rank:
+                    return min(bound, timer['max'])
+            return timer['max']
+
+        def summary(self):
+            elapsed = time.perf_counter() - self.started
+            print(f'\nMetrics of {elapsed:.1f}s')
+            print(f'  {"stage":20s} {"count":>7s} {"total s":>9s} {"mean ms":>9s} {"p50 ms":>9s} {"p95 ms":>9s} {"max ms":>9s}')
+            for name, timer in sorted(self.timers.items()):
+                print(f'  {name:20s} {timer["count"]:7d} {timer["sum"]:9.2f} {timer["sum"]*1000/timer["count"]:9.1f} {self.quantile(name, 0.5)*1000:9.1f} {self.quantile(name, 0.95)*1000:9.1f} {timer["max"]*1000:9.1f}')
+            for name, value in sorted(self.counters.items()):
+                print(f'  {name:20s} {value:>13.1f}' if isinstance(value, float) else f'  {name:20s} {value:>13d}')
+            for stage in ['render_kml', 'render_gpx']:
+                if stage in self.timers and self.timers[stage]['sum'] > 0:
+                    print(f'  {stage:20s} {self.counters.get("points_" + stage[-3:], 0)/self.timers[stage]["sum"]:9.0f} points/s')
+
+        def dump_json(self, file: str):
+            with open(file, 'w', encoding='utf-8') as f:
+                json.dump({'elapsed': time.perf_counter() - self.started, 'buckets': [str(bound) for bound in self.BUCKETS]
+                           , 'timers': self.timers, 'counters': self.counters}, f, indent=2)
+
+        # Prometheus textfile format, eg. for the textfile collector of node_exporter
+        def dump_prometheus(self, file: str):
+            lines = []
+            for name, timer in sorted(self.timers.items()):
+                lines.append(f'# TYPE fr24_{name}_seconds histogram')
+                seen = 0
+                for bound, count in zip(self.BUCKETS, timer['buckets']):
+                    seen += count
+                    lines.append(f'fr24_{name}_seconds_bucket{{le="{"+Inf" if bound == float("inf") else bound}"}} {seen}')
+                lines.append(f'fr24_{name}_seconds_sum {timer["sum"]}')
+                lines.append(f'fr24_{name}_seconds_count {timer["count"]}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE fr24_{name}_total counter')
+                lines.append(f'fr24_{name}_total {value}')
+            with open(file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+
+        def report(self, file: str = None):
+            self.summary()
+            if file and file.endswith('.prom'):
+                self.dump_prometheus(file)
+            elif file:
+                self.dump_json(file)
+
+    # Time every call of a function with metrics
+    def timed(name: str):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with metrics.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
 
     class Flight_Summary:
         def __init__(self, hex_id: str):
@@ -90,6 +484,632 @@ if __name__ == '__main__':
                 'real_dest': self.real_dest
                 }
 
+    # Session with a sized pool of keep-alive connections, and timeouts on every request
+    class Pooled_Session(requests.Session):
+        def __init__(self, pool_size: int = 10, timeout: tuple[float, float] = (10, 60)):
+            super().__init__()
+            self.timeout = timeout
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.mount('https://', adapter)
+            self.mount('http://', adapter)
+
+        def request(self, method, url, **kwargs):
+            kwargs.setdefault('timeout', self.timeout)
+            return super().request(method, url, **kwargs)
+
+    # A new session, or with --http2 the one shared client, which multiplexes requests over its connections
+    def new_session():
+        if http2_client is not None:
+            return http2_client
+        return Pooled_Session(pool_size=arg_dict['pool_size'], timeout=tuple(arg_dict['timeout']))
+
+    # Each worker thread keeps its own session
+    worker_local = threading.local()
+    def get_worker_session() -> requests.Session:
+        if not hasattr(worker_local, 'session'):
+            worker_local.session = new_session()
+        return worker_local.session
+
+    # Async client without httpx: every request runs on a thread of its own pool, with the session of that thread
+    class Threaded_Async_Client:
+        def __init__(self, concurrency: int = 1):
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+        async def request(self, method: str, url: str, headers: dict = None):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, lambda: get_worker_session().request(method=method, url=url, headers=headers))
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            self.executor.shutdown(wait=False)
+
+    # Client of --engine async, httpx if installed, with enough connections for the requests in flight
+    def new_async_client(concurrency: int):
+        if httpx is None:
+            return Threaded_Async_Client(concurrency)
+        connect_timeout, read_timeout = arg_dict['timeout']
+        return httpx.AsyncClient(http2=arg_dict['http2'], timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                                 , limits=httpx.Limits(max_connections=max(arg_dict['pool_size'], concurrency), max_keepalive_connections=max(arg_dict['pool_size'], concurrency)))
+
+    # Records of a file appended one line at a time, each parsed by parse
+    # Lines that do not parse are skipped, like a header, or a line cut short by an interrupted run
+    def read_lines(file: str, parse):
+        with open(file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield parse(line)
+                except (ValueError, IndexError):
+                    continue
+
+    # Index of saved responses, so finished flights are never fetched twice
+    # Every entry is one line of json, appended when a response is saved
+    class Response_Cache:
+        def __init__(self, index_file: str, list_ttl: float = 0, enabled: bool = True):
+            self.index_file = index_file
+            self.list_ttl = list_ttl
+            self.enabled = enabled
+            self.entries: dict[str, dict] = {}
+            self.lock = threading.Lock()
+            if os.path.exists(self.index_file):
+                self.load()
+            else:
+                self.rebuild()
+
+        @staticmethod
+        def flight_key(flight_id: str):
+            return f'flight:{flight_id.lower()}'
+
+        @staticmethod
+        def list_key(reg_id: str, page: int):
+            return f'list:{reg_id}:{page}'
+
+        def load(self):
+            for entry in read_lines(self.index_file, json.loads):
+                self.entries[entry['key']] = entry
+
+        # Index responses saved before the index existed
+        def rebuild(self):
+            for root, dirs, files in os.walk(RESPONSE_DIR):
+                for filename in files:
+                    if filename.startswith('List_') or not is_response_file(filename):
+                        continue
+                    flight_id = response_flight_id(filename)
+                    path = os.path.join(root, filename)
+                    self.put(self.flight_key(flight_id), path, final=True, fetched=os.path.getmtime(path))
+
+        # Returns the saved response, or None if it should be fetched again
+        def get(self, key: str):
+            if not self.enabled:
+                return None
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not entry['final'] and (self.list_ttl <= 0 or time.time() - entry['fetched'] > self.list_ttl):
+                return None
+            path = os.path.join(WORKING_DIR, entry['path'])
+            if not os.path.exists(path):
+                return None
+            return read_response(path)
+
+        def put(self, key: str, path: str, final: bool, fetched: float = None):
+            entry = {
+                'key': key,
+                'path': os.path.relpath(path, WORKING_DIR),
+                'final': final,
+                'fetched': fetched if fetched is not None else time.time()
+                }
+            with self.lock:
+                self.entries[key] = entry
+                os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+                with open(self.index_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry)+'\n')
+
+    # Manifest of written outputs, so flights already rendered with the same options are skipped
+    # Every entry is one line of json, appended after each output is written, the last one of a flight and format wins
+    class Output_Manifest:
+        def __init__(self, manifest_file: str, options_hashes: dict[str, str]):
+            self.manifest_file = manifest_file
+            self.options_hashes = options_hashes
+            self.entries: dict[tuple, dict] = {}
+            self.lock = threading.Lock()
+            if os.path.exists(self.manifest_file):
+                self.load()
+
+        def load(self):
+            for entry in read_lines(self.manifest_file, json.loads):
+                self.entries[(entry['flight_id'], entry['format'])] = entry
+
+        # Whether every format was written with the current options, and the files are still there
+        def is_complete(self, flight_id: str, formats: list[str]) -> bool:
+            if not formats:
+                return False
+            for format in formats:
+                entry = self.entries.get((flight_id.lower(), format))
+                if entry is None or entry['options'] != self.options_hashes[format]:
+                    return False
+                if not all(os.path.exists(os.path.join(WORKING_DIR, path)) for path in entry['paths']):
+                    return False
+            return True
+
+        def put(self, flight_id: str, format: str, paths: list[str]):
+            entry = {
+                'flight_id': flight_id.lower(),
+                'format': format,
+                'options': self.options_hashes[format],
+                'paths': [os.path.relpath(path, WORKING_DIR) if os.path.splitdrive(path)[0] == os.path.splitdrive(WORKING_DIR)[0] else path for path in paths],
+                'written': time.time()
+                }
+            # One write of one line, so processes appending together do not mix their lines
+            line = json.dumps(entry)+'\n'
+            with self.lock:
+                self.entries[(entry['flight_id'], format)] = entry
+                with open(self.manifest_file, 'a', encoding='utf-8') as f:
+                    f.write(line)
+
+    # Append-only record of the ids a -r4 sweep has finished, so it can be resumed
+    # Lines are "<HEX_ID> <status>", and "# <HEX_ID>" means every id below it is finished
+    class Sweep_Journal:
+        def __init__(self, journal_file: str, start_num: int, resume: bool = False):
+            self.journal_file = journal_file
+            self.watermark = start_num
+            self.done_above: set[int] = set()
+            # Ids that ended with an error, passed by the watermark but not done, so they are tried again on resume
+            self.errors: set[int] = set()
+            self.since_checkpoint = 0
+            # Ids of each last status, also those of the runs before
+            self.counts: dict[str, int] = {}
+            self.lock = threading.Lock()
+            if resume and os.path.exists(journal_file):
+                self.load()
+            os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+            self.f = open(journal_file, 'a' if resume else 'w', encoding='utf-8', buffering=1)
+
+        # A line as its two fields, the id or '#', and the status or the watermark
+        @staticmethod
+        def parse_line(line: str) -> tuple[str, str]:
+            name, value = line.split()
+            return name, value
+
+        def load(self):
+            for name, value in read_lines(self.journal_file, Sweep_Journal.parse_line):
+                if name == '#':
+                    self.watermark = max(self.watermark, int(value, 16))
+                    self.done_above = {n for n in self.done_above if n >= self.watermark}
+                    continue
+                self.record(int(name, 16), value)
+            self.advance()
+
+        # An error is counted until the same id is done with another status
+        def record(self, n: int, status: str):
+            if n in self.errors:
+                self.errors.remove(n)
+                self.counts[FLIGHT_ERROR] -= 1
+            if status == FLIGHT_ERROR:
+                self.errors.add(n)
+            self.counts[status] = self.counts.get(status, 0) + 1
+            if n >= self.watermark:
+                self.done_above.add(n)
+
+        # Move the watermark over every finished id
+        def advance(self):
+            while self.watermark in self.done_above:
+                self.done_above.remove(self.watermark)
+                self.watermark += 1
+                self.since_checkpoint += 1
+
+        # Only found and missing ids are done, errors are fetched again
+        def is_done(self, n: int) -> bool:
+            return (n < self.watermark or n in self.done_above) and n not in self.errors
+
+        # Ids between the watermark and end_num still to be fetched, and the ids with errors
+        def remaining(self, end_num: int) -> int:
+            return end_num - self.watermark - len(self.done_above) + len(self.errors)
+
+        def mark(self, flight_id: str, status: str):
+            with self.lock:
+                self.f.write(f'{flight_id} {status}\n')
+                self.record(int(flight_id, 16), status)
+                self.advance()
+                if self.since_checkpoint >= SWEEP_CHECKPOINT_EVERY:
+                    self.f.write(f'# {self.watermark:08X}\n')
+                    self.since_checkpoint = 0
+
+        def close(self):
+            with self.lock:
+                self.f.write(f'# {self.watermark:08X}\n')
+                self.f.close()
+
+    # FR24 hex ids and the timestamps of their first track point, saved in FR24_HEX_DATE_FILE
+    # Hex ids are given out roughly in time order, so the ids are kept sorted to interpolate between them
+    class Hex_Date_Index:
+        def __init__(self, index_file: str):
+            self.index_file = index_file
+            self.hex_nums: list[int] = []
+            self.timestamps: list[int] = []
+            self.lock = threading.Lock()
+            if os.path.exists(index_file):
+                self.load()
+
+        # A line as the hex id and the timestamp, the header does not parse
+        @staticmethod
+        def parse_line(line: str) -> tuple[int, int]:
+            fields = line.strip().split(',')
+            return int(fields[0], 16), int(fields[1])
+
+        def load(self):
+            for hex_num, timestamp in read_lines(self.index_file, Hex_Date_Index.parse_line):
+                self.insert(hex_num, timestamp)
+
+        def insert(self, hex_num: int, timestamp: int) -> bool:
+            i = bisect.bisect_left(self.hex_nums, hex_num)
+            if i < len(self.hex_nums) and self.hex_nums[i] == hex_num:
+                return False
+            self.hex_nums.insert(i, hex_num)
+            self.timestamps.insert(i, timestamp)
+            return True
+
+        def add(self, flight_id: str, timestamp: int):
+            with self.lock:
+                if not self.insert(int(flight_id, 16), timestamp):
+                    return
+                new_file = not os.path.exists(self.index_file)
+                with open(self.index_file, 'a', encoding='utf-8') as f:
+                    if new_file:
+                        f.write('hex_id,timestamp\n')
+                    f.write(f'{flight_id.upper()},{timestamp}\n')
+
+        def __len__(self):
+            return len(self.hex_nums)
+
+        # Known (hex_num, timestamp) pairs just before and after a timestamp, None if outside the index
+        def bracket(self, timestamp: int):
+            i = bisect.bisect_left(self.timestamps, timestamp)
+            before = (self.hex_nums[i-1], self.timestamps[i-1]) if i > 0 else None
+            after = (self.hex_nums[i], self.timestamps[i]) if i < len(self.hex_nums) else None
+            return before, after
+
+    # Hold an exclusive lock on lock_file, shared with other processes, flock or msvcrt on Windows
+    @contextlib.contextmanager
+    def file_lock(lock_file: str):
+        with open(lock_file, 'a+b') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK gives up after 10 seconds
+                        continue
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    # HEX IDs known to be empty and known to be flights, as two bitmaps over the 32-bit id space
+    # The bitmaps are split into pages of 65536 ids by the high 16 bits, each saved in PROBE_CACHE_DIR only once used
+    # A page file holds the times its buckets of 256 ids last had an empty id recorded, the bitmap of empty ids, then the bitmap of flights
+    # Empty ids of a bucket are forgotten once the TTL has passed since then, as FR24 could still give them out later
+    class Probe_Cache:
+        PAGE_SHIFT = 16
+        PAGE_BYTES = (1 << PAGE_SHIFT) // 8
+        BUCKET_SHIFT = 8
+        BUCKETS = 1 << (PAGE_SHIFT - BUCKET_SHIFT)
+        BUCKET_BYTES = (1 << BUCKET_SHIFT) // 8
+
+        def __init__(self, cache_dir: str, ttl: float = 30*86400, enabled: bool = True):
+            self.cache_dir = cache_dir
+            self.ttl = ttl
+            self.enabled = enabled and ttl > 0
+            # Page number: [bucket times, empty bitmap, flight bitmap]
+            self.pages: dict[int, list] = {}
+            self.dirty: set[int] = set()
+            self.since_save = 0
+            self.lock = threading.Lock()
+
+        def page_file(self, page_num: int) -> str:
+            return os.path.join(self.cache_dir, f'{page_num:04X}.bin')
+
+        # Read a page file, with the empty ids of expired buckets cleared, None if there is no valid page
+        # Pages saved with one time for the whole page are read with that time for every bucket
+        def read_page(self, page_num: int):
+            try:
+                with open(self.page_file(page_num), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+            if len(data) == 8*self.BUCKETS + 2*self.PAGE_BYTES:
+                stamps = array.array('q', data[:8*self.BUCKETS])
+                if sys.byteorder == 'big':
+                    stamps.byteswap()
+                data = data[8*self.BUCKETS:]
+            elif len(data) == 8 + 2*self.PAGE_BYTES:
+                stamps = array.array('q', [int.from_bytes(data[:8], 'little')])*self.BUCKETS
+                data = data[8:]
+            else:
+                return None
+            empty = bytearray(data[:self.PAGE_BYTES])
+            flights = bytearray(data[self.PAGE_BYTES:])
+            now = time.time()
+            for bucket, stamp in enumerate(stamps):
+                if stamp and now - stamp > self.ttl:
+                    empty[bucket*self.BUCKET_BYTES:(bucket+1)*self.BUCKET_BYTES] = bytes(self.BUCKET_BYTES)
+                    stamps[bucket] = 0
+            return [stamps, empty, flights]
+
+        def page_bytes(self, page: list) -> bytes:
+            stamps = array.array('q', page[0])
+            if sys.byteorder == 'big':
+                stamps.byteswap()
+            return stamps.tobytes() + bytes(page[1]) + bytes(page[2])
+
+        def page(self, page_num: int) -> list:
+            if page_num not in self.pages:
+                self.pages[page_num] = self.read_page(page_num) or [array.array('q', [0])*self.BUCKETS, bytearray(self.PAGE_BYTES), bytearray(self.PAGE_BYTES)]
+            return self.pages[page_num]
+
+        def bit(self, n: int, bitmap: int) -> bool:
+            page = self.page(n >> self.PAGE_SHIFT)
+            i = n & ((1 << self.PAGE_SHIFT) - 1)
+            return bool(page[bitmap][i >> 3] & (1 << (i & 7)))
+
+        # Consulted before requesting an id, a known flight overrides an empty bit left by another worker
+        def is_empty(self, n: int) -> bool:
+            if not self.enabled:
+                return False
+            with self.lock:
+                return self.bit(n, 1) and not self.bit(n, 2)
+
+        # Record a probed HEX ID, flights also clear the empty bit, errors are not recorded
+        def mark(self, flight_id: str, status: str):
+            if not self.enabled or status not in [FLIGHT_FOUND, FLIGHT_MISSING]:
+                return
+            n = int(flight_id, 16)
+            page_num = n >> self.PAGE_SHIFT
+            i = n & ((1 << self.PAGE_SHIFT) - 1)
+            with self.lock:
+                page = self.page(page_num)
+                if status == FLIGHT_FOUND:
+                    page[2][i >> 3] |= 1 << (i & 7)
+                    page[1][i >> 3] &= ~(1 << (i & 7)) & 0xFF
+                elif not page[2][i >> 3] & (1 << (i & 7)):
+                    page[1][i >> 3] |= 1 << (i & 7)
+                    page[0][i >> self.BUCKET_SHIFT] = int(time.time())
+                self.dirty.add(page_num)
+                self.since_save += 1
+                if self.since_save >= PROBE_CACHE_SAVE_EVERY:
+                    self.save_pages()
+
+        # Pages are merged with the files on disk under one lock of the folder, so workers sharing it keep each other's ids
+        def save_pages(self):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with file_lock(os.path.join(self.cache_dir, 'pages.lock')):
+                for page_num in self.dirty:
+                    stamps, empty, flights = self.pages[page_num]
+                    saved = self.read_page(page_num)
+                    if saved is not None:
+                        stamps = array.array('q', map(max, stamps, saved[0]))
+                        empty = bytearray(a | b for a, b in zip(empty, saved[1]))
+                        flights = bytearray(a | b for a, b in zip(flights, saved[2]))
+                        empty = bytearray(a & ~b & 0xFF for a, b in zip(empty, flights))
+                        self.pages[page_num] = [stamps, empty, flights]
+                    temp_file = f'{self.page_file(page_num)}.{os.getpid()}.tmp'
+                    with open(temp_file, 'wb') as f:
+                        f.write(self.page_bytes(self.pages[page_num]))
+                    os.replace(temp_file, self.page_file(page_num))
+            self.dirty.clear()
+            self.since_save = 0
+
+        def save(self):
+            with self.lock:
+                if self.dirty:
+                    self.save_pages()
+
+    # A set of HEX IDs as a bitmap, in pages of 65536 ids allocated when first used
+    # Memory grows with the span of the ids, not with their number
+    class Hex_Bitmap:
+        def __init__(self):
+            self.pages: dict[int, bytearray] = {}
+
+        # Returns False if n was already in the set
+        def add(self, n: int) -> bool:
+            page = self.pages.get(n >> Probe_Cache.PAGE_SHIFT)
+            if page is None:
+                page = self.pages[n >> Probe_Cache.PAGE_SHIFT] = bytearray(Probe_Cache.PAGE_BYTES)
+            i = n & ((1 << Probe_Cache.PAGE_SHIFT) - 1)
+            if page[i >> 3] & (1 << (i & 7)):
+                return False
+            page[i >> 3] |= 1 << (i & 7)
+            return True
+
+    # Hex ids from start_num to end_num (exclusive), generated one at a time
+    # Ids known to be empty in the probe cache are skipped, and recorded as missing in the journal
+    def hex_range(start_num: int, end_num: int, journal: Sweep_Journal = None, probe_cache: Probe_Cache = None):
+        skipped = 0
+        for n in range(start_num, end_num):
+            if journal is not None and journal.is_done(n):
+                continue
+            flight_id = '{:08x}'.format(n).upper()
+            if probe_cache is not None and probe_cache.is_empty(n):
+                skipped += 1
+                metrics.add('skipped_empty')
+                if journal is not None:
+                    journal.mark(flight_id, FLIGHT_MISSING)
+                continue
+            yield flight_id
+        if skipped:
+            print(f'\n{skipped} HEX IDs skipped, known to be empty')
+
+    # Shards of a -r4 range, handed out to worker processes from a SQLite file, on one machine or on shared storage
+    # The rollback journal is used instead of WAL, which does not work over network file systems
+    # A shard whose worker stopped renewing its lease is handed out again
+    # A shard finished with errors waits in 'retry' for a cool down, and after SHARD_MAX_ATTEMPTS tries stays in 'errors'
+    class Shard_Queue:
+        def __init__(self, queue_file: str):
+            self.queue_file = queue_file
+            self.lock = threading.Lock()
+            self.conn = sqlite3.connect(queue_file, timeout=60, isolation_level=None, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=DELETE')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS shards (
+                start_num INTEGER PRIMARY KEY,
+                end_num INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'todo',
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                found INTEGER NOT NULL DEFAULT 0,
+                missing INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0)''')
+
+        # BEGIN IMMEDIATE takes the write lock first, so two workers never claim the same shard
+        @contextlib.contextmanager
+        def transaction(self):
+            with self.lock:
+                self.conn.execute('BEGIN IMMEDIATE')
+                try:
+                    yield self.conn
+                except BaseException:
+                    self.conn.execute('ROLLBACK')
+                    raise
+                self.conn.execute('COMMIT')
+
+        # Split a range into shards, returns False if the queue already has shards
+        # Shards of an existing queue which ran out of attempts are tried again
+        def create(self, start_num: int, end_num: int, shard_size: int) -> bool:
+            with self.transaction() as conn:
+                if conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]:
+                    conn.execute("UPDATE shards SET state = 'todo', attempts = 0 WHERE state = 'errors'")
+                    return False
+                conn.executemany('INSERT INTO shards (start_num, end_num) VALUES (?, ?)'
+                                 , [(n, min(n + shard_size, end_num)) for n in range(start_num, end_num, shard_size)])
+            return True
+
+        # The first shard not taken, with an expired lease, or done cooling down, as (start_num, end_num), None if all are taken
+        def claim(self, worker: str, lease_seconds: float = SHARD_LEASE_SECONDS):
+            now = time.time()
+            with self.transaction() as conn:
+                shard = conn.execute('''SELECT start_num, end_num FROM shards
+                    WHERE state = 'todo' OR (state IN ('leased', 'retry') AND lease_until < ?) ORDER BY start_num LIMIT 1''', (now,)).fetchone()
+                if shard is not None:
+                    conn.execute("UPDATE shards SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1 WHERE start_num = ?", (worker, now + lease_seconds, shard[0]))
+            return shard
+
+        # When the next shard waiting in 'retry' can be claimed, None if there is none
+        def next_retry(self):
+            with self.lock:
+                return self.conn.execute("SELECT MIN(lease_until) FROM shards WHERE state = 'retry'").fetchone()[0]
+
+        # Returns False if the shard was handed to another worker meanwhile
+        def renew(self, start_num: int, worker: str, lease_seconds: float = SHARD_LEASE_SECONDS) -> bool:
+            with self.transaction() as conn:
+                cursor = conn.execute("UPDATE shards SET lease_until = ? WHERE start_num = ? AND worker = ? AND state = 'leased'"
+                                      , (time.time() + lease_seconds, start_num, worker))
+            return cursor.rowcount == 1
+
+        # A shard with errors left is handed out again, its journal only gives the ids with errors
+        def complete(self, start_num: int, worker: str, counts: dict[str, int]):
+            errors = counts.get(FLIGHT_ERROR, 0)
+            with self.transaction() as conn:
+                conn.execute('''UPDATE shards SET found = ?, missing = ?, errors = ?,
+                    state = CASE WHEN ? = 0 THEN 'done' WHEN attempts >= ? THEN 'errors' ELSE 'retry' END,
+                    lease_until = CASE WHEN ? = 0 THEN NULL ELSE ? END
+                    WHERE start_num = ? AND worker = ?'''
+                    , (counts.get(FLIGHT_FOUND, 0), counts.get(FLIGHT_MISSING, 0), errors, errors, SHARD_MAX_ATTEMPTS, errors, time.time() + SHARD_RETRY_SECONDS, start_num, worker))
+
+        # Number of shards in each state, and the flights found, missing and with errors in finished shards
+        def progress(self) -> dict[str, int]:
+            with self.lock:
+                rows = self.conn.execute('SELECT state, COUNT(*), SUM(found), SUM(missing), SUM(errors) FROM shards GROUP BY state').fetchall()
+            progress = {'todo': 0, 'leased': 0, 'retry': 0, 'done': 0, 'errors': 0, 'found': 0, 'missing': 0, 'flight_errors': 0}
+            for state, n_shards, found, missing, errors in rows:
+                progress[state] = n_shards
+                if state in ['done', 'retry', 'errors']:
+                    progress['found'] += found
+                    progress['missing'] += missing
+                    progress['flight_errors'] += errors
+            return progress
+
+        def progress_text(self) -> str:
+            progress = self.progress()
+            return (f"Shards: {progress['done']} done, {progress['leased']} running, {progress['todo']} to do, "
+                    f"{progress['retry']} to retry, {progress['errors']} given up; "
+                    f"{progress['found']} found, {progress['missing']} missing, {progress['flight_errors']} errors")
+
+    # Flight summaries of all regs, in a SQLite database indexed by hex id, reg, timestamp and callsign
+    # HEXs/<reg>_hex.json files are exported from it with --export-json
+    class Summary_Store:
+        def __init__(self, db_file: str):
+            self.db_file = db_file
+            new_db = not os.path.exists(db_file)
+            self.lock = threading.Lock()
+            self.conn = sqlite3.connect(db_file, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS summaries (
+                hex_id TEXT PRIMARY KEY,
+                reg TEXT NOT NULL,
+                timestamp INTEGER,
+                callsign TEXT,
+                origin TEXT,
+                real_dest TEXT)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS summaries_reg ON summaries (reg, hex_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS summaries_timestamp ON summaries (timestamp)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS summaries_callsign ON summaries (callsign)')
+            self.conn.commit()
+            if new_db:
+                for hex_file in sorted(glob.glob(os.path.join(HEX_DIR, '*_hex.json'))):
+                    self.import_json(hex_file)
+
+        # Import an old HEXs/<reg>_hex.json file
+        def import_json(self, hex_file: str):
+            with open(hex_file, 'r', encoding='utf-8') as f:
+                try:
+                    loaded_dict: dict = json.load(f)
+                except json.decoder.JSONDecodeError:
+                    return
+            for reg_id, raw_summaries in loaded_dict.items():
+                summaries = [Flight_Summary.from_dict(raw_summary) for raw_summary in raw_summaries]
+                self.upsert(reg_id, [summary for summary in summaries if isinstance(summary, Flight_Summary) and type(summary.hex_id) is str])
+
+        def upsert(self, reg_id: str, summaries: list[Flight_Summary]):
+            with self.lock:
+                self.conn.executemany('''INSERT INTO summaries (hex_id, reg, timestamp, callsign, origin, real_dest) VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(hex_id) DO UPDATE SET reg=excluded.reg, timestamp=excluded.timestamp, callsign=excluded.callsign, origin=excluded.origin, real_dest=excluded.real_dest''',
+                    [(summary.hex_id, reg_id, summary.timestamp, summary.callsign, summary.origin, summary.real_dest) for summary in summaries])
+                self.conn.commit()
+
+        # All summaries of a reg, newest hex id first
+        def summaries(self, reg_id: str) -> list[Flight_Summary]:
+            with self.lock:
+                rows = self.conn.execute('SELECT hex_id, timestamp, callsign, origin, real_dest FROM summaries WHERE reg = ? ORDER BY hex_id DESC', (reg_id,)).fetchall()
+            summaries = []
+            for hex_id, timestamp, callsign, origin, real_dest in rows:
+                summary = Flight_Summary(hex_id)
+                summary.timestamp = timestamp
+                summary.callsign = callsign
+                summary.origin = origin
+                summary.real_dest = real_dest
+                summaries.append(summary)
+            return summaries
+
+        def known_ids(self, reg_id: str) -> set[str]:
+            with self.lock:
+                return {row[0] for row in self.conn.execute('SELECT hex_id FROM summaries WHERE reg = ?', (reg_id,))}
+
+        def export_json(self, reg_id: str, summaries: list[Flight_Summary] = None):
+            if summaries is None:
+                summaries = self.summaries(reg_id)
+            HEX_FILE = os.path.join(HEX_DIR, f'{reg_id}_hex.json')
+            with open(HEX_FILE, 'w', encoding='utf-8') as f:
+                json.dump({reg_id: summaries}, f, indent=2, cls=AdvancedJSONEncoder)
+
     # A class for encoding object into JSON
     class AdvancedJSONEncoder(json.JSONEncoder):
         def default(self, obj):
@@ -102,316 +1122,993 @@ if __name__ == '__main__':
     #-----------------------------
     # Main functions
     #-----------------------------
+    # The summary store is opened on first use, by the run modes listing flights
+    # Other run modes, like -r10 workers on shared storage where WAL does not work, never open it
+    summary_store = None
+    summary_store_lock = threading.Lock()
+    def get_summary_store() -> Summary_Store:
+        global summary_store
+        with summary_store_lock:
+            if summary_store is None:
+                summary_store = Summary_Store(SUMMARY_DB_FILE)
+            return summary_store
+
+    # URL of a page of flights of a reg, later pages continue from the last flight of the page before
+    def list_page_url(reg_id: str, page: int, token: str, list_dict: dict = None):
+        REG_URL_ADDITIONAL_TEMPLATE = '&timestamp=[TIMESTAMP]&olderThenFlightId=[HEX_ID]'
+        reg_url = REG_URL_TEMPLATE.replace('[REG_ID]', reg_id).replace('[TOKEN]', token).replace('[PAGE]', str(page))
+        # If more than one page, payload needs to include some details about last page
+        if page > 1:
+            last_id = list_dict['result']['response']['data'][-1]['identification']['id']
+            # If the last flight within the page is None, it should be converted into '' 
+            if not last_id:
+                last_id = ''
+            timestamp = list_dict['result']['response']['data'][-1]['time']['scheduled']['departure']
+            reg_url += REG_URL_ADDITIONAL_TEMPLATE.replace('[TIMESTAMP]', str(timestamp)).replace('[HEX_ID]', last_id)
+        return reg_url
+
+    # Save a fetched page of flights of a reg
+    def save_list_page(reg_id: str, page: int, response_content: bytes):
+        os.makedirs(os.path.join(RESPONSE_DIR, reg_id), exist_ok=True)
+        if save_response:
+            RESPONSE1_FILE = os.path.join(RESPONSE_DIR, reg_id, f'List_{reg_id}_{page:03d}.json')
+            RESPONSE1_FILE = write_response(RESPONSE1_FILE, response_content)
+            response_cache.put(Response_Cache.list_key(reg_id, page), RESPONSE1_FILE, final=False)
+
+    # Hex ids and summaries of the flights in a page, and whether to get the next page
+    # Returns None if the page has no results
+    def parse_list_page(list_dict: dict, page: int, known_ids: set[str]):
+        if list_dict['result']['response']['data'] is None:
+            print('  No results found')
+            return None
+    
+        ids = [list_dict['result']['response']['data'][i]['identification']['id'] for i in range(len(list_dict['result']['response']['data'])) if list_dict['result']['response']['data'][i]['identification']['id']]
+
+        # Extracting summary of each flight
+        summaries: list[Flight_Summary] = []
+        for data in list_dict['result']['response']['data']:
+            if data['identification']['id'] is not None:
+                flight_summary = Flight_Summary(data['identification']['id'])
+            else:
+                continue
+            # Callsign
+            if data['identification']['number']['default']:
+                flight_summary.callsign = data['identification']['number']['default']
+            else:
+                flight_summary.callsign = f"({data['identification']['callsign']})"
+            # Real Departure Time
+            if data['time']['real']['departure']:
+                flight_summary.timestamp = data['time']['real']['departure']
+            else:
+                flight_summary.timestamp = data['time']['scheduled']['departure']
+            # Origin
+            if data['airport']['origin']:
+                flight_summary.origin = data['airport']['origin']['code']['iata']
+            # Real Destination
+            if data['airport']['real']:
+                flight_summary.real_dest = data['airport']['real']['code']['iata']
+            elif data['airport']['destination']:
+                flight_summary.real_dest = data['airport']['destination']['code']['iata']
+            # Append to summaries list
+            summaries.append(flight_summary)
+
+        # Prepare for next page
+        more_page = list_dict['result']['response']['page']['more']
+        if known_ids and any(data['identification']['id'] in known_ids for data in list_dict['result']['response']['data']):
+            print(f"  Page {page:3d} reached known flights, stop listing")
+            more_page = False
+        return ids, summaries, more_page
+
+    # Save summaries to the store, newer summaries replace older ones with the same hex id
+    # HEXs/<reg>_hex.json is only written again with --export-json, as it holds every flight of the reg
+    def finish_listing(reg_id: str, ids: list[str], summaries: list[Flight_Summary]):
+        if save_response:
+            get_summary_store().upsert(reg_id, summaries)
+            if arg_dict['export_json']:
+                get_summary_store().export_json(reg_id)
+        
+        print(f'  {len(ids):2d} results found:')
+        if ids:
+            print(f'    {ids[0]}')
+            print(f'      ....')
+            print(f'    {ids[-1]}\n')
+        return summaries
+
     # List flights' hex ids from reg
-    def list_flights(reg_id: str, s: requests.Session, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str=""):
+    # If incremental, stop at the first page with a flight already in the summary store
+    @timed('list_flights')
+    def list_flights(reg_id: str, s: requests.Session, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str="", incremental: bool = False):
         print(f"\nListing Flight of [{reg_id}]")
+        known_ids = get_summary_store().known_ids(reg_id) if incremental else set()
         
         # Result may have multiple pages
         page = 1
         more_page = True
         ids: list[str] = []
         summaries: list[Flight_Summary] = []
-        REG_URL_ADDITIONAL_TEMPLATE = '&timestamp=[TIMESTAMP]&olderThenFlightId=[HEX_ID]'
+        list_dict = None
         
         while more_page:
-            os.makedirs(os.path.join(RESPONSE_DIR, reg_id), exist_ok=True)
-            RESPONSE1_FILE = os.path.join(RESPONSE_DIR, reg_id, f'List_{reg_id}_{page:03d}.json')
             print(f"  Getting Page {page:3d} of [{reg_id}]")
-            
-            # Generate URL
-            reg_url = REG_URL_TEMPLATE.replace('[REG_ID]', reg_id).replace('[TOKEN]', token).replace('[PAGE]', str(page))
-            # If more than one page, payload needs to include some details about last page
-            if page > 1:
-                time.sleep(2)
-                last_id = list_dict['result']['response']['data'][-1]['identification']['id']
-                # If the last flight within the page is None, it should be converted into '' 
-                if not last_id:
-                    last_id = ''
-                timestamp = list_dict['result']['response']['data'][-1]['time']['scheduled']['departure']
-                reg_url += REG_URL_ADDITIONAL_TEMPLATE.replace('[TIMESTAMP]', str(timestamp)).replace('[HEX_ID]', last_id)
-
-            # Getting Data
-            r = multiple_requests(s, reg_url, method='GET', headers=headers)
-            if r.status_code!=200:
-                print(f'Error code {r.status_code}')
-                return []
+            reg_url = list_page_url(reg_id, page, token, list_dict)
 
-            # Saving Data
-            if save_response:
-                with open(RESPONSE1_FILE, 'w', encoding='utf-8') as f:
-                    f.write(r.text)
+            # Getting Data, from cache if the page is fresh enough
+            response_content = response_cache.get(Response_Cache.list_key(reg_id, page))
+            if response_content is None:
+                r = multiple_requests(s, reg_url, method='GET', headers=headers)
+                if r is None:
+                    print('Connection failed')
+                    return ids, summaries
+                if r.status_code!=200:
+                    print(f'Error code {r.status_code}')
+                    return ids, summaries
+                response_content = r.content
+                save_list_page(reg_id, page, response_content)
+            else:
+                print(f"    Page {page:3d} found in cache")
+                metrics.add('cache_hits')
 
             # Processing Data
-            list_dict = json.loads(r.text)
-
-            if list_dict['result']['response']['data'] is None:
-                print('  No results found')
+            with metrics.timer('parse'):
+                list_dict = json_loads(response_content)
+            parsed = parse_list_page(list_dict, page, known_ids)
+            if parsed is None:
                 return ids, summaries
+            page_ids, page_summaries, more_page = parsed
+            ids += page_ids
+            summaries += page_summaries
+            page += 1
         
-            ids += [list_dict['result']['response']['data'][i]['identification']['id'] for i in range(len(list_dict['result']['response']['data'])) if list_dict['result']['response']['data'][i]['identification']['id']]
+        summaries = finish_listing(reg_id, ids, summaries)
+        return ids, summaries
 
-            # Extracting summary of each flight
-            for data in list_dict['result']['response']['data']:
-                if data['identification']['id'] is not None:
-                    flight_summary = Flight_Summary(data['identification']['id'])
-                else:
-                    continue
-                # Callsign
-                if data['identification']['number']['default']:
-                    flight_summary.callsign = data['identification']['number']['default']
-                else:
-                    flight_summary.callsign = f"({data['identification']['callsign']})"
-                # Real Departure Time
-                if data['time']['real']['departure']:
-                    flight_summary.timestamp = data['time']['real']['departure']
-                else:
-                    flight_summary.timestamp = data['time']['scheduled']['departure']
-                # Origin
-                if data['airport']['origin']:
-                    flight_summary.origin = data['airport']['origin']['code']['iata']
-                # Real Destination
-                if data['airport']['real']:
-                    flight_summary.real_dest = data['airport']['real']['code']['iata']
-                elif data['airport']['destination']:
-                    flight_summary.real_dest = data['airport']['destination']['code']['iata']
-                # Append to summaries list
-                summaries.append(flight_summary)
-
-            # Prepare for next page
-            more_page = list_dict['result']['response']['page']['more']
+    # list_flights on an async client, files and the summary store are handled on threads
+    async def list_flights_async(reg_id: str, client, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str="", incremental: bool = False):
+        print(f"\nListing Flight of [{reg_id}]")
+        known_ids = await asyncio.to_thread(get_summary_store().known_ids, reg_id) if incremental else set()
+
+        page = 1
+        more_page = True
+        ids: list[str] = []
+        summaries: list[Flight_Summary] = []
+        list_dict = None
+
+        while more_page:
+            print(f"  Getting Page {page:3d} of [{reg_id}]")
+            reg_url = list_page_url(reg_id, page, token, list_dict)
+
+            response_content = await asyncio.to_thread(response_cache.get, Response_Cache.list_key(reg_id, page))
+            if response_content is None:
+                r = await multiple_requests_async(client, reg_url, method='GET', headers=headers)
+                if r is None:
+                    print('Connection failed')
+                    return ids, summaries
+                if r.status_code!=200:
+                    print(f'Error code {r.status_code}')
+                    return ids, summaries
+                response_content = r.content
+                await asyncio.to_thread(save_list_page, reg_id, page, response_content)
+            else:
+                print(f"    Page {page:3d} found in cache")
+                metrics.add('cache_hits')
+
+            with metrics.timer('parse'):
+                list_dict = json_loads(response_content)
+            parsed = parse_list_page(list_dict, page, known_ids)
+            if parsed is None:
+                return ids, summaries
+            page_ids, page_summaries, more_page = parsed
+            ids += page_ids
+            summaries += page_summaries
             page += 1
-        
-        # Save summaries to file
-        if save_response:
-            HEX_FILE = os.path.join(HEX_DIR, f'{reg_id}_hex.json')
-            valid_old_file = False
-            old_summaries: list[Flight_Summary] = []
-            # Check whether old file exists
-            if os.path.exists(HEX_FILE):
-                valid_old_file = True
-                with open(HEX_FILE, 'r', encoding='utf-8') as f:
-                    try:
-                        loaded_dict: dict = json.load(f)
-                    except json.decoder.JSONDecodeError:
-                        loaded_dict = {}
-                # Our target reg_id is the only key in the loaded file
-                if len(loaded_dict) == 1 and reg_id in loaded_dict.keys():
-                    for raw_summary in loaded_dict[reg_id]:
-                        old_summary = Flight_Summary.from_dict(raw_summary)
-                        if not isinstance(old_summary, Flight_Summary):
-                            valid_old_file = False
-                            break
-                        old_summaries.append(old_summary)
-                else:
-                    valid_old_file = False
-                # After iterating old file, decide which to do
-                if valid_old_file:
-                    print('  Old file found: Appending')
-                else:
-                    old_summaries = []
-                    print('  Old file found: Overwriting')
-            # Merging with old summaries
-            for old_summary in old_summaries:
-                if old_summary.hex_id not in ids and type(old_summary.hex_id) is str:
-                    summaries.append(old_summary)
-            summaries = sorted(summaries, key=lambda x: x.hex_id, reverse=True)
-            # Output final result
-            with open(HEX_FILE, 'w', encoding='utf-8') as f:
-                json.dump({reg_id: summaries}, f, indent=2, cls=AdvancedJSONEncoder)
-        
-        print(f'  {len(ids):2d} results found:')
-        print(f'    {ids[0]}')
-        print(f'      ....')
-        print(f'    {ids[-1]}\n')
+
+        summaries = await asyncio.to_thread(finish_listing, reg_id, ids, summaries)
         return ids, summaries
     
     
     # List flights' hex ids from reg
-    def list_flights_from_list(s: requests.Session, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str = ''):
+    def list_flights_from_list(s: requests.Session, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str = '', workers: int = 1, incremental: bool = False):
         # Getting reg list
         with open(FLEET_LIST_FILE, 'r') as f:
             reg_id_list: list[str] = [line.strip() for line in f.readlines() if not line.strip().startswith('#')]
         
         print(f'Listing Flights of {len(reg_id_list)} aircrafts, this might take a while')
         
-        # Iterate across regs
+        # Iterate across regs, all requests share the same rate limiter
+        ids_dict: dict[str:list[str]] = {}
+        summaries_dict: dict[str:list[Flight_Summary]] = {}
+        if workers <= 1:
+            for reg_id in reg_id_list:
+                # Get flight from a reg
+                ids_dict[reg_id], summaries_dict[reg_id] = list_flights(reg_id, s, headers, output_tz, token, incremental)
+        else:
+            def worker(reg_id: str):
+                return list_flights(reg_id, get_worker_session(), headers, output_tz, token, incremental)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                for reg_id, (ids, summaries) in zip(reg_id_list, executor.map(worker, reg_id_list)):
+                    ids_dict[reg_id] = ids
+                    summaries_dict[reg_id] = summaries
+
+        return ids_dict, summaries_dict
+
+    # list_flights_async of one reg, on its own client
+    async def list_flights_async_once(reg_id: str, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str = '', incremental: bool = False):
+        async with new_async_client(1) as client:
+            return await list_flights_async(reg_id, client, headers, output_tz, token, incremental)
+
+    # list_flights_from_list on an async client, with up to "concurrency" regs listed at once
+    async def list_flights_from_list_async(headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, token: str = '', concurrency: int = 1, incremental: bool = False):
+        with open(FLEET_LIST_FILE, 'r') as f:
+            reg_id_list: list[str] = [line.strip() for line in f.readlines() if not line.strip().startswith('#')]
+        
+        print(f'Listing Flights of {len(reg_id_list)} aircrafts, this might take a while')
+
+        semaphore = asyncio.Semaphore(concurrency)
+        async with new_async_client(concurrency) as client:
+            async def list_one(reg_id: str):
+                async with semaphore:
+                    return await list_flights_async(reg_id, client, headers, output_tz, token, incremental)
+            results = await asyncio.gather(*(list_one(reg_id) for reg_id in reg_id_list))
+
         ids_dict: dict[str:list[str]] = {}
         summaries_dict: dict[str:list[Flight_Summary]] = {}
-        for reg_id in reg_id_list:
-            # Get flight from a reg
-            ids, summaries = list_flights(reg_id, s, headers, output_tz, token)
+        for reg_id, (ids, summaries) in zip(reg_id_list, results):
             ids_dict[reg_id] = ids
             summaries_dict[reg_id] = summaries
-            time.sleep(1)
-
         return ids_dict, summaries_dict
 
-    # Fetch data of flight hex id
-    def search_flight(flight_id: str, s: requests.Session, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, clear_cookie: bool = False, save_hex2date: bool = True):
+    def flight_playback_url(flight_id: str) -> str:
+        timestamp_str = str(int((datetime.datetime.now()).timestamp()))
+        return FLIGHT_URL_TEMPLATE.replace('[FLIGHT_ID]', flight_id).replace('[TIMESTAMP]', timestamp_str)
+
+    # Get the raw response of flight hex id, from cache or from FR24
+    # Returns the response and whether it was from cache, or None if the request failed
+    def fetch_flight(flight_id: str, s: requests.Session, headers: dict, clear_cookie: bool = False):
         print(f"\nSearching Flight: {flight_id}")
 
         # Generate URL
-        timestamp_str = str(int((datetime.datetime.now()).timestamp()))
-        flight_url = FLIGHT_URL_TEMPLATE.replace('[FLIGHT_ID]', flight_id).replace('[TIMESTAMP]', timestamp_str)
+        flight_url = flight_playback_url(flight_id)
         print("  "+flight_url)
 
-        # Getting Data
-        if clear_cookie:
-            s.cookies.clear()
-        r = s.get(flight_url, headers=headers)
-        if r.status_code!=200:
-            print(f'Error code {r.statuscode}')
-            return
+        # Getting Data, finished flights are taken from cache
+        flight_key = Response_Cache.flight_key(flight_id)
+        response_content = response_cache.get(flight_key)
+        from_cache = response_content is not None
+        if from_cache:
+            print("  Found in cache")
+            metrics.add('cache_hits')
+        else:
+            # The --http2 client is shared by all workers, so its cookies are left for the others
+            if clear_cookie and s is not http2_client:
+                s.cookies.clear()
+            r = multiple_requests(s, flight_url, method='GET', headers=headers)
+            if r is None:
+                print('Connection failed')
+                return
+            if r.status_code!=200:
+                print(f'Error code {r.status_code}')
+                return
+            response_content = r.content
+        return response_content, from_cache
+
+    # fetch_flight on an async client, the cache is read on a thread
+    async def fetch_flight_async(flight_id: str, client, headers: dict):
+        print(f"\nSearching Flight: {flight_id}")
+        flight_url = flight_playback_url(flight_id)
+        print("  "+flight_url)
+
+        response_content = await asyncio.to_thread(response_cache.get, Response_Cache.flight_key(flight_id))
+        from_cache = response_content is not None
+        if from_cache:
+            print("  Found in cache")
+            metrics.add('cache_hits')
+        else:
+            r = await multiple_requests_async(client, flight_url, method='GET', headers=headers)
+            if r is None:
+                print('Connection failed')
+                return
+            if r.status_code!=200:
+                print(f'Error code {r.status_code}')
+                return
+            response_content = r.content
+        return response_content, from_cache
 
+    # Parse a fetched response, save it and its hex-to-date info, and return the flight
+    def parse_flight(flight_id: str, response_content: bytes, from_cache: bool, output_tz: datetime.timezone = datetime.timezone.utc, save_hex2date: bool = True):
         # Saving Data
-        full_dict = json.loads(r.text)
+        # The track is converted to columns once here, and read as a Track from then on
+        with metrics.timer('parse'):
+            flight_dict = json_loads(response_content)['result']['response']['data']['flight']
+            flight_dict['track'] = Track.from_points(flight_dict['track'])
 
-        reg = full_dict['result']['response']['data']['flight']['aircraft']['identification']['registration']
-        eventTimestamp = full_dict['result']['response']['data']['flight']['status']['generic']['eventTime']['utc']
+        reg = flight_dict['aircraft']['identification']['registration']
+        eventTimestamp = flight_dict['status']['generic']['eventTime']['utc']
         try:
             eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
         except TypeError:
-            eventTimestamp = full_dict['result']['response']['data']['flight']['track'][-1]['timestamp']
+            eventTimestamp = flight_dict['track'].timestamp[-1]
             eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
 
         # Filename will depend on flight status
-        if full_dict['result']['response']['data']['flight']['status']['generic']['status']['text'] in ['landed', 'diverted']:
-            print(f"  {reg}, {full_dict['result']['response']['data']['flight']['status']['generic']['status']['text']}")
-            if save_response:
+        status_text = flight_dict['status']['generic']['status']['text']
+        if status_text in ['landed', 'diverted']:
+            print(f"  {reg}, {status_text}")
+            if save_response and not from_cache:
                 os.makedirs(os.path.join(WORKING_DIR, 'Responses', reg), exist_ok=True)
                 RESPONSE2_FILE = os.path.join(WORKING_DIR, 'Responses', reg, f'{eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")}_{flight_id}.json')
-                with open(RESPONSE2_FILE, 'w', encoding='utf-8') as f:
-                    f.write(r.text)
+                RESPONSE2_FILE = write_response(RESPONSE2_FILE, response_content)
+                # Landed or diverted flights will not change anymore
+                response_cache.put(Response_Cache.flight_key(flight_id), RESPONSE2_FILE, final=True)
         else:
             # For tracks that have status not in ['landed', 'diverted']
-            print(f"  {reg}, {full_dict['result']['response']['data']['flight']['status']['generic']['status']['text']}")
+            print(f"  {reg}, {status_text}")
             if save_response:
                 os.makedirs(os.path.join(RESPONSE_ERROR_DIR, reg), exist_ok=True)
                 RESPONSE2_FILE = os.path.join(RESPONSE_ERROR_DIR, reg, f'{eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")}_{flight_id}.json')
-                with open(RESPONSE2_FILE, 'w', encoding='utf-8') as f:
-                    f.write(r.text)
+                write_response(RESPONSE2_FILE, response_content)
             else:
                 print("    json will not be saved")
         
-        # TODO, Saving to hex-to-date database
-        if save_hex2date:
-            for trkpt_dict in full_dict['result']['response']['data']['flight']['track']:
-                trkptTime = datetime.datetime.fromtimestamp(trkpt_dict['timestamp'], tz=datetime.timezone.utc)
-                print(trkptTime.isoformat())
-                break
+        # Saving to hex-to-date database
+        if save_hex2date and flight_dict['track']:
+            hex_date_index.add(flight_id, flight_dict['track'].timestamp[0])
 
-        return full_dict['result']['response']['data']['flight']
+        return flight_dict
 
-    # Save fetched data to kml
-    def outputKML(flight_dict: dict, specific_path, output_tz: datetime.timezone = datetime.timezone.utc, timezone_mode = 2):
-        if flight_dict == None:
+    # Fetch data of flight hex id
+    # If expected_reg is given, flights of other regs are skipped before parsing the response
+    @timed('search_flight')
+    def search_flight(flight_id: str, s: requests.Session, headers: dict, output_tz: datetime.timezone = datetime.timezone.utc, clear_cookie: bool = False, save_hex2date: bool = True, expected_reg: str = None):
+        fetched = fetch_flight(flight_id, s, headers, clear_cookie=clear_cookie)
+        if fetched is None:
             return
-        track_list = flight_dict['track']
+        response_content, from_cache = fetched
 
-        coords_str = '\n'.join([f'          {point["longitude"]},{point["latitude"]},{point["altitude"]["meters"]}' for point in track_list])
-        
-        reg = flight_dict['aircraft']['identification']['registration']
-        eventTimestamp = flight_dict['status']['generic']['eventTime']['utc']
+        if expected_reg and not re.search(rb'"registration":\s*"' + re.escape(expected_reg.encode('utf-8')) + rb'"', response_content):
+            print(f"  Not {expected_reg}")
+            return
+
+        return parse_flight(flight_id, response_content, from_cache, output_tz=output_tz, save_hex2date=save_hex2date)
+
+    # First track point timestamp of a hex id, or None if there is no such flight
+    # Ids known to be empty in the probe cache are not requested
+    def probe_hex(hex_num: int, s: requests.Session, headers: dict):
+        flight_id = '{:08x}'.format(hex_num).upper()
+        if probe_cache.is_empty(hex_num):
+            metrics.add('skipped_empty')
+            return None
         try:
-            eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
-        except TypeError:
-            eventTimestamp = flight_dict['track'][-1]['timestamp']
-            eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
+            flight_dict = search_flight(flight_id=flight_id, s=s, headers=headers, save_hex2date=False)
+        except (KeyError, TypeError, IndexError) as e:
+            print('    '+str(e))
+            probe_cache.mark(flight_id, FLIGHT_MISSING)
+            return None
+        if flight_dict is None:
+            return None
+        probe_cache.mark(flight_id, FLIGHT_FOUND)
+        if not flight_dict['track']:
+            return None
+        timestamp = flight_dict['track'].timestamp[0]
+        hex_date_index.add(flight_id, timestamp)
+        return timestamp
 
-        if flight_dict["identification"]["number"]["default"]:
-            flt_num = flight_dict["identification"]["number"]["default"]
+    # Find the hex id of a flight starting at a timestamp, by interpolating between known hex ids
+    def find_hex_by_time(target: int, s: requests.Session, headers: dict, tolerance: int = 60, max_probes: int = 50):
+        # Seed an empty index with some known samples
+        if len(hex_date_index) < 2:
+            print('Hex-to-date index is empty, probing samples')
+            for sample in ID_SAMPLES:
+                for hex_num in range(int(sample, 16), int(sample, 16)+HEX_PROBE_STEPS):
+                    if probe_hex(hex_num, s, headers) is not None:
+                        break
+        if len(hex_date_index) < 2:
+            print('error: not enough samples found')
+            return None
+
+        probes = 0
+        while probes < max_probes:
+            before, after = hex_date_index.bracket(target)
+            if before and abs(before[1] - target) <= tolerance:
+                break
+            if after and abs(after[1] - target) <= tolerance:
+                break
+            if before and after:
+                if after[0] - before[0] <= 1:
+                    break
+                # Inner interpolation, between two known points
+                estimate = before[0] + (target - before[1])*(after[0] - before[0])//max(after[1] - before[1], 1)
+                estimate = min(max(estimate, before[0]+1), after[0]-1)
+                known = before[0]
+            else:
+                # Outer interpolation, extending the slope of the two nearest points
+                (n1, t1), (n2, t2) = [(hex_date_index.hex_nums[i], hex_date_index.timestamps[i]) for i in ([0, 1] if after else [-2, -1])]
+                estimate = n2 + (target - t2)*(n2 - n1)//max(t2 - t1, 1)
+                known = n1 if after else n2
+
+            # If the estimate is not a flight, try the next few ids, then jump halfway back to the known point
+            found = False
+            while probes < max_probes and estimate != known:
+                for hex_num in range(estimate, estimate+HEX_PROBE_STEPS):
+                    probes += 1
+                    if probe_hex(hex_num, s, headers) is not None:
+                        found = True
+                        break
+                if found:
+                    break
+                estimate = (estimate + known)//2
+            if not found:
+                break
+
+        # Closest known hex id
+        before, after = hex_date_index.bracket(target)
+        candidates = [point for point in [before, after] if point]
+        best = min(candidates, key=lambda point: abs(point[1] - target))
+        print(f'\nClosest flight found with {probes} probes:')
+        for hex_num, timestamp in candidates:
+            mark = '*' if (hex_num, timestamp) == best else ' '
+            print(f'  {mark} {hex_num:08X}  {datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).isoformat()}')
+        if before and after and abs(best[1] - target) > tolerance:
+            print(f'  Flights starting in between should be found with: -r4 {before[0]:08X} {after[0]+1:08X}')
+        return '{:08x}'.format(best[0]).upper()
+
+    # Find a flight of a reg starting between two timestamps, by walking the hex ids in between
+    def search_reg_in_window(reg_id: str, start: int, end: int, s: requests.Session, headers: dict):
+        # Narrow the hex ids down to the window first
+        find_hex_by_time(start, s=s, headers=headers)
+        find_hex_by_time(end, s=s, headers=headers)
+        start_point = hex_date_index.bracket(start)[0] or hex_date_index.bracket(start)[1]
+        before_end, after_end = hex_date_index.bracket(end)
+        end_point = after_end or before_end
+        if start_point is None or end_point is None:
+            print('error: could not locate the window')
+            return None
+        start_num, end_num = start_point[0], end_point[0]+1
+
+        # Without a known flight after END, the walk goes on past the closest one before it, until a flight starts after END
+        # Flights of other regs are read there too, to know their times
+        open_end = after_end is None
+        if open_end:
+            print(f'\nSearching {reg_id} from {start_num:08X}, until a flight starts after the window')
         else:
-            flt_num = flight_dict["identification"]["callsign"]
-        
-        # Handle timezone option
-        if timezone_mode == TIMEZONE_UTC:
-            time_str = eventTime.isoformat(timespec="minutes").replace("+00:00", "Z").replace(":","")
-        elif timezone_mode == TIMEZONE_CUSTOM:
-            time_str = eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")
-        elif timezone_mode == TIMEZONE_AUTO:
+            print(f'\nSearching {reg_id} within {end_num - start_num} hex ids, {start_num:08X} to {end_num-1:08X}')
+
+        empty_in_row = 0
+        for flight_id in hex_range(start_num, 1 << 32 if open_end else end_num, probe_cache=probe_cache):
+            beyond = open_end and int(flight_id, 16) >= end_num
             try:
-                output_tzinfo = datetime.timezone(datetime.timedelta(seconds=flight_dict['airport']['destination']['timezone']['offset']))
-                time_str = eventTime.astimezone(tz=output_tzinfo).isoformat(timespec="minutes").replace(":","")
+                flight_dict = search_flight(flight_id=flight_id, s=s, headers=headers, output_tz=output_tz, save_hex2date=save_hex2date, expected_reg=None if beyond else reg_id)
+            except (KeyError, TypeError, IndexError) as e:
+                print('    '+str(e))
+                probe_cache.mark(flight_id, FLIGHT_MISSING)
+                if beyond:
+                    empty_in_row += 1
+                    if empty_in_row >= WINDOW_WALK_MAX_EMPTY:
+                        print(f'  {empty_in_row} empty HEX IDs in a row, no newer flights yet')
+                        break
+                continue
+            if flight_dict is None:
+                continue
+            if beyond:
+                empty_in_row = 0
+                if flight_dict['track'] and flight_dict['track'].timestamp[0] > end:
+                    print('  Past the end of the window')
+                    break
+                if flight_dict['aircraft']['identification']['registration'] != reg_id:
+                    print(f"  Not {reg_id}")
+                    continue
+            if not flight_dict['track'] or not start <= flight_dict['track'].timestamp[0] <= end:
+                print('  Outside of the window')
+                continue
+            print(f'\nFound {reg_id}: {flight_id}')
+            output_flight(flight_dict, flight_id, output_tz=output_tz, timezone_mode=timezone_mode)
+            return flight_id
+        print(f'\n{reg_id} not found')
+        return None
+
+    # Track points stored as columns of numbers, converted once from the FR24 track list
+    class Track:
+        __slots__ = ('latitude', 'longitude', 'altitude', 'timestamp', 'speed', 'heading')
+
+        def __init__(self):
+            self.latitude = array.array('d')
+            self.longitude = array.array('d')
+            self.altitude = array.array('q')
+            self.timestamp = array.array('q')
+            self.speed = array.array('q')
+            self.heading = array.array('q')
+
+        # Columns of only integers or only floats are kept as arrays of them, so they are written out the same
+        # A column mixing both, or with missing values, is kept as the list of its values, eg. 25 stays 25 and None stays None
+        @staticmethod
+        def column(values: list):
+            types = set(map(type, values))
+            if types <= {int}:
+                return array.array('q', values)
+            if types == {float}:
+                return array.array('d', values)
+            return values
+
+        # A column as numbers to compute with, missing values as nan
+        @staticmethod
+        def numbers(column):
+            if type(column) is list:
+                return [math.nan if value is None else value for value in column]
+            return column
+
+        @classmethod
+        def from_points(self, track_list: list[dict]):
+            track = Track()
+            track.latitude = Track.column([point['latitude'] for point in track_list])
+            track.longitude = Track.column([point['longitude'] for point in track_list])
+            track.altitude = Track.column([point['altitude']['meters'] for point in track_list])
+            track.timestamp = Track.column([point['timestamp'] for point in track_list])
+            track.speed = Track.column([(point.get('speed') or {}).get('kts') for point in track_list])
+            track.heading = Track.column([point.get('heading') for point in track_list])
+            return track
+
+        def __len__(self):
+            return len(self.timestamp)
+
+        # A new track with only the points at indices
+        def select(self, indices: list[int]):
+            track = Track()
+            for name in Track.__slots__:
+                column = getattr(self, name)
+                values = [column[i] for i in indices]
+                setattr(track, name, array.array(column.typecode, values) if type(column) is array.array else values)
+            return track
+
+    # Fewer points for a track, within a tolerance in meters (Douglas-Peucker) or seconds (time decimation)
+    # Takeoff, landing and every top/bottom of climb or descent are always kept
+    def simplify_track(track: Track, tolerance: float, unit: str = 'm') -> Track:
+        n = len(track)
+        if n <= 2:
+            return track
+
+        # Points where the altitude stops going up or down,
+        # ignoring wiggles smaller than ALTITUDE_INFLECTION_METERS
+        altitude = Track.numbers(track.altitude)
+        keep = [0]
+        direction = 0
+        extreme = 0
+        for i in range(1, n):
+            if direction == 0:
+                if abs(altitude[i] - altitude[extreme]) >= ALTITUDE_INFLECTION_METERS:
+                    direction = 1 if altitude[i] > altitude[extreme] else -1
+                    extreme = i
+            elif (altitude[i] - altitude[extreme])*direction >= 0:
+                extreme = i
+            elif (altitude[extreme] - altitude[i])*direction >= ALTITUDE_INFLECTION_METERS:
+                if keep[-1] != extreme:
+                    keep.append(extreme)
+                direction = -direction
+                extreme = i
+        if keep[-1] != n-1:
+            keep.append(n-1)
+
+        if unit == 's':
+            mandatory = set(keep)
+            kept = [0]
+            for i in range(1, n):
+                if i in mandatory or track.timestamp[i] - track.timestamp[kept[-1]] >= tolerance:
+                    kept.append(i)
+            return track.select(kept)
+
+        # Local coordinates in meters, and the farthest point between first and last from the line between them
+        # With numpy, the distances of a segment are computed at once
+        if numpy is not None:
+            latitude = numpy.asarray(track.latitude, dtype=float)
+            points = numpy.column_stack((
+                numpy.asarray(track.longitude, dtype=float)*EARTH_METERS_PER_DEGREE*numpy.cos(numpy.radians(latitude)),
+                latitude*EARTH_METERS_PER_DEGREE,
+                numpy.asarray(track.altitude, dtype=float)))
+
+            def farthest(first: int, last: int):
+                d = points[last] - points[first]
+                p = points[first+1:last] - points[first]
+                length2 = d @ d
+                t = numpy.clip(p @ d / length2, 0.0, 1.0) if length2 else numpy.zeros(len(p))
+                e = p - t[:, None]*d
+                # Points with a missing value are never the farthest, as in the loop below
+                distance2 = numpy.nan_to_num(numpy.einsum('ij,ij->i', e, e), nan=-1.0)
+                i = int(distance2.argmax())
+                return float(distance2[i]), first+1+i
+        else:
+            latitudes, longitudes = Track.numbers(track.latitude), Track.numbers(track.longitude)
+            y = [latitude*EARTH_METERS_PER_DEGREE for latitude in latitudes]
+            x = [longitude*EARTH_METERS_PER_DEGREE*math.cos(math.radians(latitude)) for longitude, latitude in zip(longitudes, latitudes)]
+            z = altitude
+
+            def farthest(first: int, last: int):
+                dx, dy, dz = x[last]-x[first], y[last]-y[first], z[last]-z[first]
+                length2 = dx*dx + dy*dy + dz*dz
+                max_distance2, max_i = -1.0, first
+                for i in range(first+1, last):
+                    px, py, pz = x[i]-x[first], y[i]-y[first], z[i]-z[first]
+                    t = min(max((px*dx + py*dy + pz*dz)/length2, 0.0), 1.0) if length2 else 0.0
+                    ex, ey, ez = px - t*dx, py - t*dy, pz - t*dz
+                    distance2 = ex*ex + ey*ey + ez*ez
+                    if distance2 > max_distance2:
+                        max_distance2, max_i = distance2, i
+                return max_distance2, max_i
+
+        # Douglas-Peucker between each pair of points that must be kept
+        kept = set(keep)
+        segments = list(zip(keep[:-1], keep[1:]))
+        while segments:
+            first, last = segments.pop()
+            if last - first < 2:
+                continue
+            max_distance2, max_i = farthest(first, last)
+            if max_distance2 > tolerance*tolerance:
+                kept.add(max_i)
+                segments.append((first, max_i))
+                segments.append((max_i, last))
+        return track.select(sorted(kept))
+
+    # Everything the outputs need from a flight, extracted once for all formats and destinations
+    class Flight_Record:
+        __slots__ = ('flight_id', 'reg', 'flt_num', 'event_time', 'time_str', 'trk_name', 'output_tz', 'track')
+
+        def __init__(self, flight_id: str):
+            self.flight_id: str = flight_id
+            self.reg: str = ''
+            self.flt_num: str = ''
+            self.event_time: datetime.datetime = None
+            self.time_str: str = ''
+            self.trk_name: str = ''
+            self.output_tz: datetime.timezone = datetime.timezone.utc
+            self.track: Track = Track()
+
+        @classmethod
+        def from_dict(self, flight_dict: dict, flight_id: str, output_tz: datetime.timezone = datetime.timezone.utc, timezone_mode = 2):
+            record = Flight_Record(flight_id)
+            record.output_tz = output_tz
+            # Parsed responses already have a Track, saved ones read by -r6 and -r9 still have the FR24 list
+            track = flight_dict['track']
+            record.track = track if type(track) is Track else Track.from_points(track)
+            record.reg = flight_dict['aircraft']['identification']['registration']
+            eventTimestamp = flight_dict['status']['generic']['eventTime']['utc']
+            try:
+                eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
             except TypeError:
-                time_str = eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")
-        # Handle output filename
-        kml_filename = time_str
-        if OUT_FLT_NUM:
+                eventTimestamp = record.track.timestamp[-1]
+                eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
+            record.event_time = eventTime
+
+            # Getting FLT NUM (eg. BR265). If null, get callsign (eg. EVA265)
             if flight_dict["identification"]["number"]["default"]:
-                kml_filename += f'_{flt_num}'
+                record.flt_num = flight_dict["identification"]["number"]["default"]
             else:
-                kml_filename += f'_{flt_num}'
-        kml_filename += f'_{reg}_{flight_id}.kml'
+                record.flt_num = flight_dict["identification"]["callsign"]
+
+            # Handle timezone option
+            if timezone_mode == TIMEZONE_UTC:
+                record.time_str = eventTime.isoformat(timespec="minutes").replace("+00:00", "Z").replace(":","")
+            elif timezone_mode == TIMEZONE_CUSTOM:
+                record.time_str = eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")
+            elif timezone_mode == TIMEZONE_AUTO:
+                try:
+                    output_tzinfo = datetime.timezone(datetime.timedelta(seconds=flight_dict['airport']['destination']['timezone']['offset']))
+                    record.time_str = eventTime.astimezone(tz=output_tzinfo).isoformat(timespec="minutes").replace(":","")
+                except TypeError:
+                    record.time_str = eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")
+
+            record.trk_name = 'Flight'
+            if OUT_FLT_NUM:
+                record.trk_name += f' {record.flt_num}'
+            record.trk_name += f' of {record.reg} at {eventTime.strftime("%Y-%m-%dZ")}'
+            return record
+
+        # Output filename, eg. 2023-09-08T2030+0800_BR265_B-16340_31d5273a.kml
+        def filename(self, extension: str):
+            filename = self.time_str
+            if OUT_FLT_NUM:
+                filename += f'_{self.flt_num}'
+            filename += f'_{self.reg}_{self.flight_id}.{extension}'
+            return filename
+
+    # Same as datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).isoformat(),
+    # but only formats the date once per day
+    @functools.lru_cache(maxsize=64)
+    def utc_date_prefix(day: int) -> str:
+        return datetime.datetime.fromtimestamp(day*86400, tz=datetime.timezone.utc).strftime('%Y-%m-%dT')
+
+    def utc_isoformat(timestamp) -> str:
+        if type(timestamp) is not int:
+            return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).isoformat()
+        day, seconds = divmod(timestamp, 86400)
+        return f'{utc_date_prefix(day)}{seconds//3600:02d}:{seconds//60%60:02d}:{seconds%60:02d}+00:00'
+
+    # Open an output file for writing text, compressed as its extension says
+    # .kmz is a zip with the kml inside as doc.kml
+    @contextlib.contextmanager
+    def open_output(file: str):
+        if file.endswith('.kmz'):
+            with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+                with io.TextIOWrapper(z.open('doc.kml', 'w'), encoding='utf-8') as f:
+                    yield f
+        elif file.endswith('.gz'):
+            with gzip.open(file, 'wt', encoding='utf-8') as f:
+                yield f
+        else:
+            with open(file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+                yield f
+
+    # Save the raw bytes of a response, compressed if asked, returns the saved filename
+    def write_response(file: str, content: bytes) -> str:
+        if response_compression == 'gzip':
+            file += '.gz'
+            with gzip.open(file, 'wb') as f:
+                f.write(content)
+        elif response_compression == 'zstd':
+            file += '.zst'
+            with open(file, 'wb') as f:
+                with zstandard.ZstdCompressor().stream_writer(f) as writer:
+                    writer.write(content)
+        else:
+            with open(file, 'wb') as f:
+                f.write(content)
+        metrics.add('bytes_saved', len(content))
+        return file
+
+    # Read the raw bytes of a saved response, compressed or not
+    def read_response(file: str) -> bytes:
+        if file.endswith('.gz'):
+            with gzip.open(file, 'rb') as f:
+                return f.read()
+        if file.endswith('.zst'):
+            if zstandard is None:
+                raise ValueError('zstandard is not installed')
+            with open(file, 'rb') as f:
+                with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                    return reader.read()
+        with open(file, 'rb') as f:
+            return f.read()
+
+    def is_response_file(filename: str) -> bool:
+        return filename.endswith(RESPONSE_FILE_EXTENSIONS)
 
-        os.makedirs(os.path.join(WORKING_DIR, 'KMLs', reg), exist_ok=True)
-        # Default kml output
-        kml_file_list = [os.path.join(WORKING_DIR, 'KMLs', reg, kml_filename)]
+    # Flight id in a response filename, eg. 2023-09-08T1230+0000_31d5273a.json.gz
+    def response_flight_id(filename: str) -> str:
+        for extension in RESPONSE_FILE_EXTENSIONS:
+            if filename.endswith(extension):
+                filename = filename[:-len(extension)]
+                break
+        return filename.rsplit('_', 1)[-1]
+
+    # Join the lines in chunks of WRITE_CHUNK_LINES, each but the first starting with the separator
+    def join_chunks(lines, separator: str = ''):
+        lines = iter(lines)
+        prefix = ''
+        while True:
+            chunk = list(itertools.islice(lines, WRITE_CHUNK_LINES))
+            if not chunk:
+                break
+            yield prefix + separator.join(chunk)
+            prefix = separator
+
+    # Write the lines to an opened file in chunks
+    def write_chunked(f, lines, separator: str = ''):
+        for chunk in join_chunks(lines, separator):
+            f.write(chunk)
+
+    # Write head, the lines in chunks, and tail to a file, without building the whole document
+    def write_streamed(file: str, head: str, lines, tail: str, separator: str = ''):
+        with open_output(file) as f:
+            f.write(head)
+            write_chunked(f, lines, separator)
+            f.write(tail)
+        metrics.add('bytes_out', os.path.getsize(file))
+
+    # Place a rendered file at other destinations, as a hardlink if on the same filesystem, or a copy if not
+    def copy_output(source: str, destinations: list[str]):
+        for destination in destinations:
+            # Already linked by an earlier run
+            if os.path.exists(destination) and os.path.samefile(source, destination):
+                continue
+            link_file = destination + '.link'
+            try:
+                if os.path.exists(link_file):
+                    os.remove(link_file)
+                os.link(source, link_file)
+                os.replace(link_file, destination)
+            except OSError:
+                shutil.copyfile(source, destination)
+
+    # Default output in WORKING_DIR/folder/reg, plus a copy in specific_path
+    def output_file_list(folder: str, reg: str, filename: str, specific_path):
+        file_list = [os.path.join(WORKING_DIR, folder, reg, filename)]
         if specific_path:
-            kml_file_list.append(os.path.join(specific_path, kml_filename))
-        for kml_file in kml_file_list:
-            with open(kml_file, 'w', encoding='utf-8') as f:
-                trk_name_str = 'Flight'
-                if OUT_FLT_NUM:
-                    trk_name_str += f' {flt_num}'
-                trk_name_str += f' of {reg} at {eventTime.strftime("%Y-%m-%dZ")}'
-                f.write(KML_TEMPLATE.replace('[COORDS]', coords_str).replace('[TRK_NAME]', trk_name_str).replace('[TRK_DSCRP]', f'{trk_name_str}, {flight_id}@FR24'))
+            file_list.append(os.path.join(specific_path, filename))
+        return file_list
+
+    # Track points as KML coordinates lines
+    def kml_coords_lines(track: Track):
+        return (f'          {longitude},{latitude},{altitude}' for longitude, latitude, altitude in zip(track.longitude, track.latitude, track.altitude))
+
+    # Track points as GPX trkpt elements
+    def gpx_coords_lines(track: Track):
+        return (f'      <trkpt lat="{latitude}" lon="{longitude}">\n        <ele>{altitude}</ele>\n        <time>{utc_isoformat(timestamp)}</time>\n      </trkpt>\n' for latitude, longitude, altitude, timestamp in zip(track.latitude, track.longitude, track.altitude, track.timestamp))
+
+    # Files and parts of the kml of a flight: head, track point lines, tail, and the separator of the lines
+    def kml_document(record: Flight_Record, specific_path):
+        os.makedirs(os.path.join(WORKING_DIR, 'KMLs', record.reg), exist_ok=True)
+        kml_file_list = output_file_list('KMLs', record.reg, record.filename(kml_extension), specific_path)
+        kml_head = KML_TEMPLATE_HEAD.replace('[TRK_NAME]', record.trk_name).replace('[TRK_DSCRP]', f'{record.trk_name}, {record.flight_id}@FR24')
+        return kml_file_list, (kml_head, kml_coords_lines(record.track), KML_TEMPLATE_TAIL, '\n')
+
+    # Files and parts of the gpx of a flight, like kml_document
+    def gpx_document(record: Flight_Record, specific_path):
+        os.makedirs(os.path.join(WORKING_DIR, 'GPXs', record.reg), exist_ok=True)
+        gpx_file_list = output_file_list('GPXs', record.reg, record.filename(gpx_extension), specific_path)
+        gpx_head = GPX_TEMPLATE_HEAD.replace('[TIME]', record.event_time.astimezone(tz=record.output_tz).isoformat(timespec="minutes").replace(":","")).replace('[TRK_NAME]', record.trk_name)
+        return gpx_file_list, (gpx_head, gpx_coords_lines(record.track), GPX_TEMPLATE_TAIL, '')
+
+    # Save fetched data to kml
+    @timed('render_kml')
+    def outputKML(record: Flight_Record, specific_path):
+        kml_file_list, (kml_head, coords_lines, kml_tail, separator) = kml_document(record, specific_path)
+        write_streamed(kml_file_list[0], kml_head, coords_lines, kml_tail, separator=separator)
+        copy_output(kml_file_list[0], kml_file_list[1:])
+        output_manifest.put(record.flight_id, 'kml', kml_file_list)
+        metrics.add('points_kml', len(record.track))
 
     # Save fetched data to gpx
-    def outputGPX(flight_dict: dict, specific_path, output_tz: datetime.timezone = datetime.timezone.utc, timezone_mode = 2):
+    @timed('render_gpx')
+    def outputGPX(record: Flight_Record, specific_path):
+        gpx_file_list, (gpx_head, coords_lines, gpx_tail, separator) = gpx_document(record, specific_path)
+        write_streamed(gpx_file_list[0], gpx_head, coords_lines, gpx_tail, separator=separator)
+        copy_output(gpx_file_list[0], gpx_file_list[1:])
+        output_manifest.put(record.flight_id, 'gpx', gpx_file_list)
+        metrics.add('points_gpx', len(record.track))
+
+    # Render a flight once into every selected format
+    def output_flight(flight_dict: dict, flight_id: str, output_tz: datetime.timezone = datetime.timezone.utc, timezone_mode = 2):
         if flight_dict == None:
             return
-        track_list = flight_dict['track']
+        record = Flight_Record.from_dict(flight_dict, flight_id, output_tz, timezone_mode)
+        if simplify_tolerance:
+            with metrics.timer('simplify'):
+                record.track = simplify_track(record.track, *simplify_tolerance)
+        if output_kml:
+            outputKML(record, specific_path=SPECIFIC_KML_PATH)
+        if output_gpx:
+            outputGPX(record, specific_path=SPECIFIC_GPX_PATH)
 
-        coords_str = ''
-        for trkpt_dict in track_list:
-            trkptTime = datetime.datetime.fromtimestamp(trkpt_dict['timestamp'], tz=datetime.timezone.utc)
-            trkpt_time_str = trkptTime.isoformat()
-            coords_str += f'      <trkpt lat="{trkpt_dict["latitude"]}" lon="{trkpt_dict["longitude"]}">\n        <ele>{trkpt_dict["altitude"]["meters"]}</ele>\n        <time>{trkpt_time_str}</time>\n      </trkpt>\n'
-        
-        reg = flight_dict['aircraft']['identification']['registration']
-        eventTimestamp = flight_dict['status']['generic']['eventTime']['utc']
+    # Render outputs again from a saved response, returns the status and number of track points
+    def rerender_response(response_file: str):
+        flight_id = response_flight_id(os.path.basename(response_file))
         try:
-            eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
-        except TypeError:
-            eventTimestamp = flight_dict['track'][-1]['timestamp']
-            eventTime = datetime.datetime.fromtimestamp(eventTimestamp, tz=datetime.timezone.utc)
+            flight_dict = json_loads(read_response(response_file))['result']['response']['data']['flight']
+            record = Flight_Record.from_dict(flight_dict, flight_id, output_tz, timezone_mode)
+
+            # Skip if every output was written with the same options, and is newer than the response
+            if not arg_dict['force'] and output_manifest.is_complete(flight_id, output_formats):
+                output_files = []
+                if output_kml:
+                    output_files += output_file_list('KMLs', record.reg, record.filename(kml_extension), SPECIFIC_KML_PATH)
+                if output_gpx:
+                    output_files += output_file_list('GPXs', record.reg, record.filename(gpx_extension), SPECIFIC_GPX_PATH)
+                response_mtime = os.path.getmtime(response_file)
+                if all(os.path.exists(output_file) and os.path.getmtime(output_file) >= response_mtime for output_file in output_files):
+                    return RENDER_SKIPPED, 0
+
+            n_points = len(record.track)
+            if simplify_tolerance:
+                with metrics.timer('simplify'):
+                    record.track = simplify_track(record.track, *simplify_tolerance)
+            if output_kml:
+                outputKML(record, specific_path=SPECIFIC_KML_PATH)
+            if output_gpx:
+                outputGPX(record, specific_path=SPECIFIC_GPX_PATH)
+            return RENDER_DONE, n_points
+        except (KeyError, TypeError, IndexError, *JSON_DECODE_ERRORS) as e:
+            print(f'  {response_file}: {e}')
+            return RENDER_FAILED, 0
 
-        # Getting FLT NUM (eg. BR265). If null, get callsign (eg. EVA265)
-        if flight_dict["identification"]["number"]["default"]:
-            flt_num = flight_dict["identification"]["number"]["default"]
+    # Render in a worker, with the metrics recorded there, to be merged in the main process
+    def rerender_task(response_file: str):
+        status, n_points = rerender_response(response_file)
+        return status, n_points, metrics.take() if metrics.enabled else None
+
+    # Saved flight responses of regs (all regs if empty), by reg then by filename
+    def saved_response_files(reg_ids: list[str], response_dirs: list[str]):
+        response_files: list[str] = []
+        for response_dir in response_dirs:
+            if not os.path.isdir(response_dir):
+                continue
+            for reg in sorted(os.listdir(response_dir)):
+                reg_dir = os.path.join(response_dir, reg)
+                if not os.path.isdir(reg_dir) or (reg_ids and reg not in reg_ids):
+                    continue
+                response_files += [os.path.join(reg_dir, filename) for filename in sorted(os.listdir(reg_dir)) if is_response_file(filename) and not filename.startswith('List_')]
+        return response_files
+
+    # Render outputs of all saved responses of regs (all regs if empty), without fetching
+    def rerender_responses(reg_ids: list[str], workers: int):
+        response_files = saved_response_files(reg_ids, [RESPONSE_DIR, RESPONSE_ERROR_DIR])
+        print(f'Rendering {len(response_files)} saved responses on {workers} workers')
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
         else:
-            flt_num = flight_dict["identification"]["callsign"]
-
-        # Handle timezone option
-        if timezone_mode == TIMEZONE_UTC:
-            time_str = eventTime.isoformat(timespec="minutes").replace("+00:00", "Z").replace(":","")
-        elif timezone_mode == TIMEZONE_CUSTOM:
-            time_str = eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")
-        elif timezone_mode == TIMEZONE_AUTO:
-            try:
-                output_tzinfo = datetime.timezone(datetime.timedelta(seconds=flight_dict['airport']['destination']['timezone']['offset']))
-                time_str = eventTime.astimezone(tz=output_tzinfo).isoformat(timespec="minutes").replace(":","")
-            except TypeError:
-                time_str = eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")
+            # Functions defined here can't be found by spawned processes, use threads instead
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
 
-        # Handle output filename
-        gpx_filename = time_str
-        if OUT_FLT_NUM:
-            gpx_filename += f'_{flt_num}'
-        gpx_filename += f'_{reg}_{flight_id}.gpx'
+        start_time = time.perf_counter()
+        counts = {RENDER_DONE: 0, RENDER_SKIPPED: 0, RENDER_FAILED: 0}
+        points = 0
+        with executor:
+            for status, n_points, metrics_state in executor.map(rerender_task, response_files, chunksize=16):
+                counts[status] += 1
+                points += n_points
+                if metrics_state:
+                    metrics.merge(metrics_state)
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
 
-        os.makedirs(os.path.join(WORKING_DIR, 'GPXs', reg), exist_ok=True)
-        # Default gpx output
-        gpx_file_list = [os.path.join(WORKING_DIR, 'GPXs', reg, gpx_filename)]
-        if specific_path:
-            gpx_file_list.append(os.path.join(specific_path, gpx_filename))
-        for gpx_file in gpx_file_list:
-            with open(gpx_file, 'w', encoding='utf-8') as f:
-                trk_name_str = 'Flight'
-                if OUT_FLT_NUM:
-                    trk_name_str += f' {flt_num}'
-                trk_name_str += f' of {reg} at {eventTime.strftime("%Y-%m-%dZ")}'
-                f.write(GPX_TEMPLATE.replace('[COORDS]', coords_str).replace('[TIME]', eventTime.astimezone(tz=output_tz).isoformat(timespec="minutes").replace(":","")).replace('[TRK_NAME]', trk_name_str))
+        print(f'  {counts[RENDER_DONE]} rendered, {counts[RENDER_SKIPPED]} up to date, {counts[RENDER_FAILED]} failed in {elapsed:.1f}s')
+        print(f'  {counts[RENDER_DONE]/elapsed:.1f} flights/s, {points/elapsed:.0f} points/s')
+
+    # Stream the saved landed flights of regs (all regs if empty) into one KML and one GPX
+    # Only one flight is read at a time, so the memory used does not grow with the number of flights
+    def export_aggregate(reg_ids: list[str], since: datetime.datetime = None, until: datetime.datetime = None):
+        name = '_'.join(reg_ids) if reg_ids else 'All'
+        if since:
+            name += '_from_' + since.isoformat(timespec="minutes").replace("+00:00", "Z").replace(":","")
+        if until:
+            name += '_to_' + until.isoformat(timespec="minutes").replace("+00:00", "Z").replace(":","")
+        os.makedirs(AGGREGATE_DIR, exist_ok=True)
+        kml_file = os.path.join(AGGREGATE_DIR, f'{name}.{kml_extension}')
+        gpx_file = os.path.join(AGGREGATE_DIR, f'{name}.{gpx_extension}')
+        export_time = datetime.datetime.now(tz=output_tz).isoformat(timespec="minutes").replace(":","")
+
+        response_files = saved_response_files(reg_ids, [RESPONSE_DIR])
+        print(f'Exporting up to {len(response_files)} saved flights to "{name}"')
+        n_flights = 0
+        n_points = 0
+        with contextlib.ExitStack() as stack:
+            kml_f = stack.enter_context(open_output(kml_file)) if output_kml else None
+            gpx_f = stack.enter_context(open_output(gpx_file)) if output_gpx else None
+            if kml_f:
+                kml_f.write(KML_AGGREGATE_HEAD.replace('[TRK_NAME]', name).replace('[TRK_DSCRP]', f'{name}, exported at {export_time}'))
+            if gpx_f:
+                gpx_f.write(GPX_AGGREGATE_HEAD.replace('[TIME]', export_time))
+
+            for response_file in response_files:
+                flight_id = response_flight_id(os.path.basename(response_file))
+                try:
+                    flight_dict = json_loads(read_response(response_file))['result']['response']['data']['flight']
+                    record = Flight_Record.from_dict(flight_dict, flight_id, output_tz, timezone_mode)
+                except (KeyError, TypeError, IndexError, *JSON_DECODE_ERRORS) as e:
+                    print(f'  {response_file}: {e}')
+                    continue
+                if (since and record.event_time < since) or (until and record.event_time > until):
+                    continue
+                if simplify_tolerance:
+                    with metrics.timer('simplify'):
+                        record.track = simplify_track(record.track, *simplify_tolerance)
+
+                if kml_f:
+                    kml_flight = KML_AGGREGATE_FLIGHT.replace('[TRK_NAME]', record.trk_name).replace('[TRK_DSCRP]', f'{record.trk_name}, {record.flight_id}@FR24')
+                    kml_flight_head, kml_flight_tail = kml_flight.split('[COORDS]', 1)
+                    kml_f.write(f'    <Folder>\n      <name>{record.trk_name}</name>\n' + kml_flight_head)
+                    write_chunked(kml_f, kml_coords_lines(record.track), separator='\n')
+                    kml_f.write(kml_flight_tail + '    </Folder>\n')
+                if gpx_f:
+                    gpx_flight_head, gpx_flight_tail = GPX_AGGREGATE_FLIGHT.replace('[TRK_NAME]', record.trk_name).split('[COORDS]', 1)
+                    gpx_f.write(gpx_flight_head)
+                    write_chunked(gpx_f, gpx_coords_lines(record.track))
+                    gpx_f.write(gpx_flight_tail)
+                n_flights += 1
+                n_points += len(record.track)
+
+            if kml_f:
+                kml_f.write(KML_AGGREGATE_TAIL)
+            if gpx_f:
+                gpx_f.write(GPX_AGGREGATE_TAIL)
+        print(f'  {n_flights} flights, {n_points} points exported into "{AGGREGATE_DIR}"')
 
     #-----------------------------
     # Argument parser
@@ -427,11 +2124,21 @@ if __name__ == '__main__':
     parser_rm_group.add_argument('-r2', action='store', metavar='HEX_ID', type=str
                                  , help='\nfetch flight of FR24 HEX_ID')
     parser_rm_group.add_argument('-r3', action='store', metavar='HEX_ID1', nargs='*', type=str
-                                 , help='\nfetch flights of FR24 HEX_IDs')
+                                 , help='\nfetch flights of FR24 HEX_IDs, read from a file with @FILE, or from stdin with -')
     parser_rm_group.add_argument('-r4', action='store', metavar='HEX_ID', nargs=2, type=str
                                  , help='\nwalkthough all flights between two FR24 HEX_IDs')
     parser_rm_group.add_argument('-r5', action='store_true'
-                                 , help='\nlist flights in "fleet_list.txt", but not fetching data\n\n')
+                                 , help='\nlist flights in "fleet_list.txt", but not fetching data')
+    parser_rm_group.add_argument('-r6', action='store', metavar='REG', nargs='*', type=str
+                                 , help='\nrender KML/GPX again from saved responses of REGs (all if none given), without fetching')
+    parser_rm_group.add_argument('-r7', action='store', metavar='DATETIME', type=str
+                                 , help='\nfind the FR24 HEX_ID of a flight starting at DATETIME, eg. 2023-09-08T12:30Z')
+    parser_rm_group.add_argument('-r8', action='store', metavar=('REG', 'START', 'END'), nargs=3, type=str
+                                 , help='\nfetch the flight of "REG" starting between datetimes START and END')
+    parser_rm_group.add_argument('-r9', action='store', metavar='REG', nargs='*', type=str
+                                 , help='\nexport saved flights of REGs (all if none given) into one KML/GPX, see "--since" and "--until"')
+    parser_rm_group.add_argument('-r10', action='store', metavar='QUEUE', type=str
+                                 , help='\nwork on shards of a -r4 range from the QUEUE file, see "--shard-queue"\n\n')
 
     # Optional Variables
     parser.add_argument('-tzm', '--timezone-mode', action='store', dest='timezone_mode', type=int, default=2, choices=range(3)
@@ -452,8 +2159,77 @@ if __name__ == '__main__':
                         , help="don't save as gpx file after fetched from server")
     parser.add_argument('-nk', '--no-kml', action='store_false', dest='output_kml'
                         , help="don't save as kml file after fetched from server")
-    parser.add_argument('-nh', '--no-hex2date', action='store_false', dest='save_hex2date'
+    parser.add_argument('-nh', '--no-hex2date', action='store_false', dest='save_hex2date', default=SAVE_HEX2DATE_INFO
                         , help="don't save relationship between fr24 hex_id & flight date")
+    parser.add_argument('-w', '--workers', action='store', dest='workers', metavar='N', default=None, type=int
+                        , help="fetch N flights at once, each worker with its own session (default 1)\nwith -r5, list N regs at once\nwith -r6, render on N processes (default all cpus)")
+    parser.add_argument('--rate', action='store', dest='rate', metavar='R', default=5.0, type=float
+                        , help="starting request rate per second, adapted while running (default 5)")
+    parser.add_argument('--max-rate', action='store', dest='max_rate', metavar='R', default=20.0, type=float
+                        , help="highest request rate per second (default 20)")
+    parser.add_argument('--max-retries', action='store', dest='max_retries', metavar='N', default=8, type=int
+                        , help="retries of a throttled request before giving up (default 8)")
+    parser.add_argument('--pool-size', action='store', dest='pool_size', metavar='N', default=10, type=int
+                        , help="keep-alive connections kept by each session (default 10)")
+    parser.add_argument('--timeout', action='store', dest='timeout', metavar=('CONNECT', 'READ'), nargs=2, default=[10.0, 60.0], type=float
+                        , help="seconds to wait for a connection and for a reply, before trying again (default 10 60)")
+    parser.add_argument('--http2', action='store_true', dest='http2'
+                        , help="use HTTP/2 over one shared client, needs: pip3 install httpx[http2]")
+    parser.add_argument('--no-compression', action='store_true', dest='no_compression'
+                        , help="ask for uncompressed responses, instead of gzip/deflate (and brotli if installed)")
+    parser.add_argument('--api-base', action='store', dest='api_base', metavar='URL', default=API_BASE_URL
+                        , help=f"base URL of the FR24 API, eg. a local test server (default {API_BASE_URL})")
+    parser.add_argument('--engine', action='store', dest='engine', choices=['thread', 'pipeline', 'async'], default='thread'
+                        , help= textwrap.dedent('''\
+                        how flights are searched with -r1, -r3, -r4
+                        thread  : every worker fetches, parses and renders a flight (default)
+                        pipeline: fetch, parse, render and write in separate stages, see "--stage-workers"
+                        async   : one event loop with "-w" requests in flight, also for -r0, -r5, eg. -w 100
+    '''))
+    parser.add_argument('--stage-workers', action='store', dest='stage_workers', metavar=('FETCH', 'PARSE', 'RENDER', 'WRITE'), nargs=4, type=int, default=None
+                        , help="threads of each stage of --engine pipeline (default: -w, 1, 1, 1)")
+    parser.add_argument('--metrics', action='store', dest='metrics', metavar='FILE', nargs='?', const='', default=None
+                        , help="print time spent in each stage at exit, and save it to FILE, as Prometheus text if it ends with .prom, or json")
+    parser.add_argument('--profile', action='store', dest='profile', metavar='FILE', nargs='?', const='', default=None
+                        , help="run with cProfile, print the slowest functions at exit, or save the stats to FILE")
+    parser.add_argument('-f', '--force', action='store_true', dest='force'
+                        , help="search and render flights again, even if already done with the same options")
+    parser.add_argument('-nc', '--no-cache', action='store_false', dest='use_cache'
+                        , help="always fetch from server, even if the response was saved before")
+    parser.add_argument('--list-ttl', action='store', dest='list_ttl', metavar='SEC', default=0, type=float
+                        , help="reuse saved flight list pages younger than SEC seconds (default 0, never)")
+    parser.add_argument('--negative-ttl', action='store', dest='negative_ttl', metavar='SEC', default=30*86400, type=float
+                        , help="with -r4 and -r8, skip HEX IDs found empty within SEC seconds (default 30 days, 0 to never skip)")
+    parser.add_argument('--export-json', action='store_true', dest='export_json'
+                        , help="with -r0, -r1 or -r5, also export all flights of each listed reg into HEXs/<reg>_hex.json")
+    parser.add_argument('-i', '--incremental', action='store_true', dest='incremental'
+                        , help="with -r0, -r1 or -r5, stop listing a reg at the first page with an already listed flight")
+    parser.add_argument('--resume', action='store_true', dest='resume'
+                        , help="with -r4, continue the sweep where the last run of the same range stopped")
+    parser.add_argument('--shard-queue', action='store', dest='shard_queue', metavar='QUEUE', default=None
+                        , help="with -r4, split the range into shards in the QUEUE file, shared with workers started by -r10 QUEUE")
+    parser.add_argument('--shard-size', action='store', dest='shard_size', metavar='N', default=4096, type=int
+                        , help="HEX IDs in each shard of --shard-queue (default 4096)")
+    parser.add_argument('--spawn', action='store', dest='spawn', metavar='K', default=0, type=int
+                        , help="with --shard-queue, start K worker processes and wait for them, instead of working on the queue itself")
+    parser.add_argument('-s', '--simplify', action='store', dest='simplify', metavar='TOL', type=str
+                        , help=textwrap.dedent('''\
+                        output fewer track points, keeping takeoff, landing, and tops of climb/descent
+                        50m: drop points within 50 meters of the simplified track
+                        30s: keep about one point every 30 seconds
+    '''))
+    parser.add_argument('--json', action='store', dest='json_backend', choices=['auto'] + sorted(JSON_LOADERS), default='auto'
+                        , help=f"json parser of responses, auto uses {JSON_BACKEND_AUTO}")
+    parser.add_argument('--kmz', action='store_true', dest='kmz'
+                        , help="save KML as compressed KMZ")
+    parser.add_argument('--gpx-gz', action='store_true', dest='gpx_gz'
+                        , help="save GPX compressed by gzip (.gpx.gz)")
+    parser.add_argument('--compress-responses', action='store', dest='response_compression', choices=['gzip', 'zstd'], default=None
+                        , help="save responses compressed (.json.gz/.json.zst), zstd needs the zstandard module")
+    parser.add_argument('--since', action='store', metavar='DATETIME', dest='since'
+                        , help="used with -r9, only export flights from DATETIME, eg. 2023-09-01")
+    parser.add_argument('--until', action='store', metavar='DATETIME', dest='until'
+                        , help="used with -r9, only export flights until DATETIME, eg. 2023-09-30T23:59")
     parser.add_argument('-c', '--copy', action='store', dest='specific_path', metavar='PATH'
                         , help="also save another GPX/KML copy to specified folder")
     
@@ -471,6 +2247,58 @@ if __name__ == '__main__':
         print(f'error: invalid FR24 HEX_ID: [{input_str}]')
         return False
     
+    # HEX IDs of -r3, each argument is an id, @FILE to read ids from a file, or - to read them from stdin
+    # Files are read line by line, ids may be separated by spaces or commas, and lines starting with # are ignored
+    # Ids are checked and de-duplicated while read, so the list is never held in memory
+    def stream_hex_ids(args: list[str]):
+        def lines_of(arg: str):
+            if arg == '-':
+                yield from sys.stdin
+            elif arg.startswith('@'):
+                with open(arg[1:], 'r', encoding='utf-8') as f:
+                    yield from f
+            else:
+                yield arg
+
+        seen = Hex_Bitmap()
+        for arg in args:
+            for line in lines_of(arg):
+                if line.strip().startswith('#'):
+                    continue
+                for id in re.split(r'[\s,]+', line.strip()):
+                    if id and is_valid_hex(id) and seen.add(int(id, 16)):
+                        yield id
+
+    # To read a datetime, naive ones are in timezone tz
+    def parse_datetime(input_str: str, tz: datetime.timezone):
+        try:
+            parsed = datetime.datetime.fromisoformat(input_str.replace('Z', '+00:00'))
+        except ValueError:
+            print(f'error: invalid DATETIME: [{input_str}]')
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=tz)
+        return parsed
+
+    # To read a simplify tolerance, eg. "50m" or "30s", meters if no unit
+    def parse_tolerance(input_str: str):
+        unit = input_str[-1] if input_str[-1:] in ['m', 's'] else 'm'
+        try:
+            tolerance = float(input_str.rstrip('ms'))
+        except ValueError:
+            tolerance = -1
+        if tolerance <= 0:
+            parser.error(f'invalid simplify tolerance: [{input_str}]')
+        return tolerance, unit
+
+    # Hash of every option changing the output of each format, to know if an old output is still valid
+    def output_options_hashes() -> dict[str, str]:
+        options = [timezone_mode, timezone_offset, simplify_tolerance, specific_path, OUT_FLT_NUM]
+        hashes = {}
+        for format, extension, template in [('kml', kml_extension, KML_TEMPLATE), ('gpx', gpx_extension, GPX_TEMPLATE)]:
+            hashes[format] = hashlib.sha1(json.dumps(options + [extension, template]).encode('utf-8')).hexdigest()[:16]
+        return hashes
+
     # Some old constants
     LIST_FLIGHT_BY_REG = 0
     SEARCH_FLIGHT_BY_REG = 1
@@ -478,12 +2306,19 @@ if __name__ == '__main__':
     SEARCH_FLIGHT_BY_FLIGHT_IDS = 3
     RUN_FOR_A_RANGE = 4
     LIST_FLIGHT_BY_REG_LIST = 5
+    RENDER_SAVED_RESPONSES = 6
+    FIND_HEX_BY_TIME = 7
+    SEARCH_REG_IN_WINDOW = 8
+    EXPORT_AGGREGATE = 9
+    SHARD_WORKER = 10
     
     TIMEZONE_UTC = 0
     TIMEZONE_CUSTOM = 1
     TIMEZONE_AUTO = 2
     
     arg_dict = vars(parser.parse_args())
+    sweep_journal = None
+    shard_range = None
 
     timezone_mode = arg_dict['timezone_mode']
     timezone_offset = arg_dict['timezone_offset']
@@ -494,15 +2329,58 @@ if __name__ == '__main__':
     output_kml = arg_dict['output_kml']
     save_hex2date = arg_dict['save_hex2date']
     
+    REG_URL_TEMPLATE = REG_URL_TEMPLATE.replace('[API_BASE]', arg_dict['api_base'].rstrip('/'))
+    FLIGHT_URL_TEMPLATE = FLIGHT_URL_TEMPLATE.replace('[API_BASE]', arg_dict['api_base'].rstrip('/'))
+    if arg_dict['http2'] and (httpx is None or h2 is None):
+        parser.error('--http2 needs the httpx and h2 modules: pip3 install httpx[http2]')
+    if arg_dict['json_backend'] != 'auto':
+        json_loads = JSON_LOADERS[arg_dict['json_backend']]
+    kml_extension = 'kmz' if arg_dict['kmz'] else 'kml'
+    gpx_extension = 'gpx.gz' if arg_dict['gpx_gz'] else 'gpx'
+    response_compression = arg_dict['response_compression']
+    if response_compression == 'zstd' and zstandard is None:
+        parser.error('--compress-responses zstd needs the zstandard module: pip3 install zstandard')
+    simplify_tolerance = parse_tolerance(arg_dict['simplify']) if arg_dict['simplify'] else None
+
     specific_path = arg_dict['specific_path']
+    workers = max(1, arg_dict['workers'] or 1)
     if specific_path:
         COPY_TO_SPECIFIC_PATH = True
 
+    # Instrumentation, reported at exit
+    metrics = Metrics(enabled=arg_dict['metrics'] is not None)
+    if metrics.enabled:
+        atexit.register(metrics.report, arg_dict['metrics'])
+    if arg_dict['profile'] is not None:
+        profiler = cProfile.Profile()
+        def report_profile(file: str):
+            profiler.disable()
+            if file:
+                profiler.dump_stats(file)
+            else:
+                pstats.Stats(profiler).sort_stats('cumulative').print_stats(30)
+        atexit.register(report_profile, arg_dict['profile'])
+        profiler.enable()
+
     # session object
+    hex_date_index = Hex_Date_Index(FR24_HEX_DATE_FILE)
+    output_formats = (['kml'] if output_kml else []) + (['gpx'] if output_gpx else [])
+    output_manifest = Output_Manifest(OUTPUT_MANIFEST_FILE, options_hashes=output_options_hashes())
+    response_cache = Response_Cache(RESPONSE_INDEX_FILE, list_ttl=arg_dict['list_ttl'], enabled=arg_dict['use_cache'])
+    probe_cache = Probe_Cache(PROBE_CACHE_DIR, ttl=arg_dict['negative_ttl'], enabled=arg_dict['use_cache'])
+    atexit.register(probe_cache.save)
+    rate_limiter = Rate_Limiter(rate=arg_dict['rate'], max_rate=arg_dict['max_rate'], max_retries=arg_dict['max_retries'])
     token = ''
-    s = requests.Session()
+    http2_client = None
+    if arg_dict['http2']:
+        connect_timeout, read_timeout = arg_dict['timeout']
+        http2_client = httpx.Client(http2=True, timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                                    , limits=httpx.Limits(max_connections=arg_dict['pool_size'], max_keepalive_connections=arg_dict['pool_size']))
+    s = new_session()
     with open(HEADERS_FILE, 'r', encoding='utf-8') as f1:
         headers = json.load(f1)
+    # Large responses are much smaller compressed
+    headers['accept-encoding'] = '*;q=0' if arg_dict['no_compression'] else ACCEPT_ENCODING
     if arg_dict['use_cookie']:
         with open(COOKIE_FILE, 'r', encoding='utf-8') as f:
             cookie_text = ''.join(f.readlines())
@@ -514,21 +2392,26 @@ if __name__ == '__main__':
     if arg_dict['r0']:
         run_mode = LIST_FLIGHT_BY_REG
         reg_id = arg_dict['r0']
-        ids, summaries = list_flights(reg_id=reg_id, s=s, headers=headers, output_tz=output_tz, token=token)
+        if arg_dict['engine'] == 'async':
+            ids, summaries = asyncio.run(list_flights_async_once(reg_id=reg_id, headers=headers, output_tz=output_tz, token=token, incremental=arg_dict['incremental']))
+        else:
+            ids, summaries = list_flights(reg_id=reg_id, s=s, headers=headers, output_tz=output_tz, token=token, incremental=arg_dict['incremental'])
         ids = []
     elif arg_dict['r1']:
         run_mode = SEARCH_FLIGHT_BY_REG
         reg_id = arg_dict['r1']
-        ids, summaries = list_flights(reg_id=reg_id, s=s, headers=headers, output_tz=output_tz)
+        if arg_dict['engine'] == 'async':
+            ids, summaries = asyncio.run(list_flights_async_once(reg_id=reg_id, headers=headers, output_tz=output_tz, incremental=arg_dict['incremental']))
+        else:
+            ids, summaries = list_flights(reg_id=reg_id, s=s, headers=headers, output_tz=output_tz, incremental=arg_dict['incremental'])
     elif arg_dict['r2'] or arg_dict['r3']:
         run_mode = SEARCH_FLIGHT_BY_FLIGHT_IDS
-        ids = []
         if arg_dict['r2']:
             arg_dict['r3'] = [arg_dict['r2']]
-        for id in arg_dict['r3']:
-            if(is_valid_hex(id)):
-                flight_id = id
-                ids.append(id)
+        for arg in arg_dict['r3']:
+            if arg.startswith('@') and not os.path.isfile(arg[1:]):
+                parser.error(f'file not found: {arg[1:]}')
+        ids = stream_hex_ids(arg_dict['r3'])
     elif arg_dict['r4']:
         run_mode = RUN_FOR_A_RANGE
         ids = []
@@ -537,22 +2420,61 @@ if __name__ == '__main__':
         if is_valid_hex(start_hex) and is_valid_hex(end_hex):
             start_num = int(start_hex, 16)
             end_num = int(end_hex, 16)
-            ids = ['{:08x}'.format(i).upper() for i in range(start_num, end_num)]
-            print(f"Tranversing all {len(ids)} entries")
+            if arg_dict['shard_queue']:
+                # Shards are handed out from the queue below
+                shard_range = (start_num, end_num)
+            else:
+                journal_file = os.path.join(CHECKPOINT_DIR, f'r4_{start_num:08X}_{end_num:08X}.log')
+                sweep_journal = Sweep_Journal(journal_file, start_num, resume=arg_dict['resume'])
+                ids = hex_range(start_num, end_num, sweep_journal, probe_cache)
+                if arg_dict['resume']:
+                    print(f"Resuming from {sweep_journal.watermark:08X}, {sweep_journal.remaining(end_num)} entries left, {len(sweep_journal.errors)} of them with errors before")
+                else:
+                    print(f"Tranversing all {end_num - start_num} entries")
         else:
             print(f'error: please check enclosing HEX_IDs')
     if arg_dict['r5']:
         run_mode = LIST_FLIGHT_BY_REG_LIST
         reg_id = arg_dict['r5']
-        ids_dict, summaries_dict = list_flights_from_list(s=s, headers=headers, output_tz=output_tz, token=token)
+        if arg_dict['engine'] == 'async':
+            ids_dict, summaries_dict = asyncio.run(list_flights_from_list_async(headers=headers, output_tz=output_tz, token=token, concurrency=workers, incremental=arg_dict['incremental']))
+        else:
+            ids_dict, summaries_dict = list_flights_from_list(s=s, headers=headers, output_tz=output_tz, token=token, workers=workers, incremental=arg_dict['incremental'])
+        ids = []
+    elif arg_dict['r6'] is not None:
+        run_mode = RENDER_SAVED_RESPONSES
+        reg_ids = arg_dict['r6']
+        ids = []
+    elif arg_dict['r7']:
+        run_mode = FIND_HEX_BY_TIME
+        ids = []
+        target_time = parse_datetime(arg_dict['r7'], output_tz)
+        if target_time:
+            find_hex_by_time(int(target_time.timestamp()), s=s, headers=headers)
+    elif arg_dict['r8']:
+        run_mode = SEARCH_REG_IN_WINDOW
+        ids = []
+        reg_id = arg_dict['r8'][0]
+        window_start = parse_datetime(arg_dict['r8'][1], output_tz)
+        window_end = parse_datetime(arg_dict['r8'][2], output_tz)
+    elif arg_dict['r9'] is not None:
+        run_mode = EXPORT_AGGREGATE
+        ids = []
+        reg_ids = arg_dict['r9']
+        export_since = parse_datetime(arg_dict['since'], output_tz) if arg_dict['since'] else None
+        export_until = parse_datetime(arg_dict['until'], output_tz) if arg_dict['until'] else None
+        if (arg_dict['since'] and not export_since) or (arg_dict['until'] and not export_until):
+            parser.error('please check "--since" and "--until"')
+    elif arg_dict['r10']:
+        run_mode = SHARD_WORKER
         ids = []
 
     #-----------------------------
     # Constants
     #-----------------------------
-    ENABLE_SLEEP = True
-    SLEEP_EVERY_N_SEARCH = 100
-    EVERY_SLEEP_DURATION = 5
+    RENDER_DONE = 'done'
+    RENDER_SKIPPED = 'skipped'
+    RENDER_FAILED = 'failed'
 
     #-----------------------------
     # Addtional directories
@@ -569,41 +2491,419 @@ if __name__ == '__main__':
         SPECIFIC_GPX_PATH = None
         SPECIFIC_KML_PATH = None
 
-    if run_mode in [SEARCH_FLIGHT_BY_REG, SEARCH_FLIGHT_BY_FLIGHT_ID, SEARCH_FLIGHT_BY_FLIGHT_IDS, RUN_FOR_A_RANGE]:
-        search_cycle = 0
-        for flight_id in ids:
-            if ENABLE_SLEEP:
-                if search_cycle >= SLEEP_EVERY_N_SEARCH:
-                    time.sleep(EVERY_SLEEP_DURATION)
-                    search_cycle = 0
-                search_cycle += 1
+    # Search a flight again with a cleared cookie after an AttributeError, FLIGHT_ABORT if it keeps failing
+    def retry_search_flight(flight_id: str, s: requests.Session):
+        for i in range(10):
             try:
-                flight_dict = search_flight(flight_id=flight_id, s=s, headers=headers, output_tz=output_tz, save_hex2date=save_hex2date)
-            except KeyError as e:
-                print('    '+str(e))
-                continue
-            except TypeError as e:
-                print('    '+str(e))
-                continue
-            except IndexError as e:
+                time.sleep(rate_limiter.backoff(i))
+                print('    AttributeError, retry shortly')
+                return search_flight(flight_id=flight_id, s=s, headers=headers, output_tz=output_tz, clear_cookie=True, save_hex2date=save_hex2date)
+            except AttributeError as e:
+                if i > 8:
+                    return FLIGHT_ABORT
+                else:
+                    continue
+
+    # Whether all outputs of a flight were written before with the same options
+    def is_already_done(flight_id: str) -> bool:
+        if arg_dict['force'] or not output_manifest.is_complete(flight_id, output_formats):
+            return False
+        print(f"\nSkipping Flight: {flight_id}, already done")
+        metrics.add('skipped_done')
+        return True
+
+    # Record a finished flight in the journal, and in the probe cache whether it is a flight
+    def record_flight(flight_id: str, status: str, journal: Sweep_Journal = None):
+        if status == FLIGHT_ABORT:
+            return
+        if journal is not None:
+            journal.mark(flight_id, status)
+        probe_cache.mark(flight_id, status)
+
+    # Search one flight and write its outputs
+    def process_flight(flight_id: str, s: requests.Session):
+        if is_already_done(flight_id):
+            return FLIGHT_FOUND
+        try:
+            flight_dict = search_flight(flight_id=flight_id, s=s, headers=headers, output_tz=output_tz, save_hex2date=save_hex2date)
+        except KeyError as e:
+            print('    '+str(e))
+            return FLIGHT_MISSING
+        except TypeError as e:
+            print('    '+str(e))
+            return FLIGHT_MISSING
+        except IndexError as e:
+            print('    '+str(e))
+            return FLIGHT_MISSING
+        except AttributeError as e:
+            flight_dict = retry_search_flight(flight_id, s)
+            if flight_dict == FLIGHT_ABORT:
+                return FLIGHT_ABORT
+        if flight_dict is None:
+            return FLIGHT_ERROR
+        output_flight(flight_dict, flight_id, output_tz=output_tz, timezone_mode=timezone_mode)
+        return FLIGHT_FOUND
+
+    # Search flights one by one, or on a pool of workers each with its own session
+    # If a journal is given, every finished id is recorded in it
+    def search_flights(ids, workers: int = 1, journal: Sweep_Journal = None):
+        def worker(flight_id: str, s: requests.Session):
+            status = process_flight(flight_id, s)
+            record_flight(flight_id, status, journal)
+            return status
+
+        def pool_worker(flight_id: str):
+            return worker(flight_id, get_worker_session())
+
+        aborted = False
+        if workers <= 1:
+            for flight_id in ids:
+                if worker(flight_id, s) == FLIGHT_ABORT:
+                    aborted = True
+                    break
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                # Keep only a bounded number of ids in flight
+                pending = set()
+                for flight_id in ids:
+                    if len(pending) >= workers*2:
+                        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        if any(future.result() == FLIGHT_ABORT for future in done):
+                            aborted = True
+                            break
+                    pending.add(executor.submit(pool_worker, flight_id))
+                for future in concurrent.futures.as_completed(pending):
+                    if future.result() == FLIGHT_ABORT:
+                        aborted = True
+        if journal is not None:
+            journal.close()
+        if aborted:
+            print('Too many AttributeError, exiting...')
+            exit()
+
+    # process_flight on an async client, parsing and rendering run on threads
+    async def process_flight_async(flight_id: str, client):
+        if is_already_done(flight_id):
+            return FLIGHT_FOUND
+        try:
+            fetched = await fetch_flight_async(flight_id, client, headers)
+            if fetched is None:
+                return FLIGHT_ERROR
+            flight_dict = await asyncio.to_thread(parse_flight, flight_id, *fetched, output_tz=output_tz, save_hex2date=save_hex2date)
+        except (KeyError, TypeError, IndexError) as e:
+            print('    '+str(e))
+            return FLIGHT_MISSING
+        except AttributeError as e:
+            flight_dict = await asyncio.to_thread(lambda: retry_search_flight(flight_id, get_worker_session()))
+            if flight_dict == FLIGHT_ABORT:
+                return FLIGHT_ABORT
+        if flight_dict is None:
+            return FLIGHT_ERROR
+        await asyncio.to_thread(output_flight, flight_dict, flight_id, output_tz=output_tz, timezone_mode=timezone_mode)
+        return FLIGHT_FOUND
+
+    # Search flights on one event loop, with up to "concurrency" flights in flight at once
+    # Ids are taken only when there is room, so a long -r4 range is never held in memory
+    async def search_flights_async(ids, concurrency: int = 1, journal: Sweep_Journal = None):
+        semaphore = asyncio.Semaphore(concurrency)
+        aborted = False
+        async with new_async_client(concurrency) as client:
+            async def worker(flight_id: str):
+                nonlocal aborted
+                try:
+                    status = await process_flight_async(flight_id, client)
+                finally:
+                    semaphore.release()
+                if status == FLIGHT_ABORT:
+                    aborted = True
+                record_flight(flight_id, status, journal)
+
+            tasks = set()
+            for flight_id in ids:
+                await semaphore.acquire()
+                if aborted:
+                    break
+                task = asyncio.create_task(worker(flight_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.gather(*tasks)
+        if journal is not None:
+            journal.close()
+        if aborted:
+            print('Too many AttributeError, exiting...')
+            exit()
+
+    # A queue bounded by the characters of the rendered documents in it, instead of their number
+    # A document larger than the bound still goes in once the queue is below it
+    class Text_Queue(queue.Queue):
+        # The None that stops a worker counts as one
+        @staticmethod
+        def weight(item) -> int:
+            if item is None:
+                return 1
+            return sum(len(chunk) for chunk in item[3]) or 1
+
+        def _init(self, maxsize: int):
+            super()._init(maxsize)
+            self.chars = 0
+
+        def _qsize(self) -> int:
+            return self.chars
+
+        def _put(self, item):
+            super()._put(item)
+            self.chars += self.weight(item)
+
+        def _get(self):
+            item = super()._get()
+            self.chars -= self.weight(item)
+            return item
+
+    # Search flights in stages connected by bounded queues: fetch, parse, render each format, and write
+    # Every stage has its own threads, and a full queue makes the stage before it wait,
+    # so requests, parsing and rendering overlap, and the slowest stage sets the pace
+    def search_flights_pipeline(ids, stage_workers: list[int], journal: Sweep_Journal = None):
+        n_fetch, n_parse, n_render, n_write = [max(1, n) for n in stage_workers]
+        fetch_queue = queue.Queue(maxsize=n_fetch*2)
+        parse_queue = queue.Queue(maxsize=n_parse*2)
+        render_queues: dict[str, queue.Queue] = {}
+        if output_kml:
+            render_queues['kml'] = queue.Queue(maxsize=n_render*2)
+        if output_gpx:
+            render_queues['gpx'] = queue.Queue(maxsize=n_render*2)
+        write_queue = Text_Queue(maxsize=WRITE_QUEUE_CHARS)
+        aborted = threading.Event()
+
+        # Formats still to be written, and whether all went well, of each flight
+        pending_formats: dict[str, list] = {}
+        pending_lock = threading.Lock()
+
+        def finish(flight_id: str, status: str):
+            record_flight(flight_id, status, journal)
+
+        def format_done(flight_id: str, ok: bool):
+            with pending_lock:
+                pending = pending_formats[flight_id]
+                pending[0] -= 1
+                pending[1] = pending[1] and ok
+                if pending[0] > 0:
+                    return
+                del pending_formats[flight_id]
+            finish(flight_id, FLIGHT_FOUND if pending[1] else FLIGHT_ERROR)
+
+        def fetch(flight_id: str):
+            if is_already_done(flight_id):
+                finish(flight_id, FLIGHT_FOUND)
+                return
+            s = get_worker_session()
+            fetched = fetch_flight(flight_id, s, headers)
+            if fetched is None:
+                finish(flight_id, FLIGHT_ERROR)
+                return
+            parse_queue.put((flight_id, *fetched, s))
+
+        def parse(flight_id: str, response_content: bytes, from_cache: bool, s: requests.Session):
+            try:
+                flight_dict = parse_flight(flight_id, response_content, from_cache, output_tz=output_tz, save_hex2date=save_hex2date)
+            except (KeyError, TypeError, IndexError) as e:
                 print('    '+str(e))
-                continue
+                finish(flight_id, FLIGHT_MISSING)
+                return
             except AttributeError as e:
-                for i in range(10):
-                    try:
-                        time.sleep(EVERY_SLEEP_DURATION*(i+1))
-                        print('    AttributeError, retry shortly')
-                        flight_dict = search_flight(flight_id=flight_id, s=s, headers=headers, output_tz=output_tz, clear_cookie=True, save_hex2date=save_hex2date)
-                        break
-                    except AttributeError as e:
-                        if i > 8:
-                            print('Too many AttributeError, exiting...')
-                            exit()
-                        else:
-                            continue
-            if output_kml:
-                outputKML(flight_dict, specific_path=SPECIFIC_KML_PATH, timezone_mode=timezone_mode)
-            if output_gpx:
-                outputGPX(flight_dict, specific_path=SPECIFIC_GPX_PATH, timezone_mode=timezone_mode)
+                flight_dict = retry_search_flight(flight_id, s)
+                if flight_dict == FLIGHT_ABORT:
+                    aborted.set()
+                    return
+            if flight_dict is None:
+                finish(flight_id, FLIGHT_ERROR)
+                return
+            record = Flight_Record.from_dict(flight_dict, flight_id, output_tz, timezone_mode)
+            if simplify_tolerance:
+                with metrics.timer('simplify'):
+                    record.track = simplify_track(record.track, *simplify_tolerance)
+            if not render_queues:
+                finish(flight_id, FLIGHT_FOUND)
+                return
+            with pending_lock:
+                pending_formats[flight_id] = [len(render_queues), True]
+            for render_queue in render_queues.values():
+                render_queue.put((flight_id, record))
+
+        def render(extension: str):
+            document = kml_document if extension == 'kml' else gpx_document
+            specific_path = SPECIFIC_KML_PATH if extension == 'kml' else SPECIFIC_GPX_PATH
+            # The document is handed to the writer as chunks, not joined into one string
+            # Each document is held whole until written, the write queue is bounded by their size
+            def render_format(flight_id: str, record: Flight_Record):
+                with metrics.timer(f'render_{extension}'):
+                    file_list, (head, lines, tail, separator) = document(record, specific_path)
+                    chunks = [head, *join_chunks(lines, separator), tail]
+                metrics.add(f'points_{extension}', len(record.track))
+                write_queue.put((flight_id, extension, file_list, chunks))
+            return render_format
+
+        def write(flight_id: str, extension: str, file_list: list[str], chunks: list[str]):
+            with metrics.timer('write'):
+                with open_output(file_list[0]) as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+                copy_output(file_list[0], file_list[1:])
+            output_manifest.put(flight_id, extension, file_list)
+            metrics.add('bytes_out', os.path.getsize(file_list[0]))
+            format_done(flight_id, True)
+
+        # Run a stage until it gets None, an error only fails the flight
+        def stage_worker(in_queue: queue.Queue, handle, on_error):
+            while True:
+                item = in_queue.get()
+                if item is None:
+                    return
+                if aborted.is_set():
+                    continue
+                try:
+                    handle(*item)
+                except Exception as e:
+                    print(f'    {item[0]}: {type(e).__name__}, {e}')
+                    on_error(item[0])
+
+        def start_stage(in_queue: queue.Queue, n_threads: int, handle, on_error):
+            threads = [threading.Thread(target=stage_worker, args=(in_queue, handle, on_error), daemon=True) for _ in range(n_threads)]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        def stop_stage(in_queue: queue.Queue, threads: list[threading.Thread]):
+            for _ in threads:
+                in_queue.put(None)
+            for thread in threads:
+                thread.join()
+
+        flight_failed = lambda flight_id: finish(flight_id, FLIGHT_ERROR)
+        format_failed = lambda flight_id: format_done(flight_id, False)
+        fetch_threads = start_stage(fetch_queue, n_fetch, fetch, flight_failed)
+        parse_threads = start_stage(parse_queue, n_parse, parse, flight_failed)
+        render_threads = {extension: start_stage(render_queue, n_render, render(extension), format_failed) for extension, render_queue in render_queues.items()}
+        write_threads = start_stage(write_queue, n_write, write, format_failed)
+
+        # Stages are stopped in order, after everything before them is done
+        for flight_id in ids:
+            if aborted.is_set():
+                break
+            fetch_queue.put((flight_id,))
+        stop_stage(fetch_queue, fetch_threads)
+        stop_stage(parse_queue, parse_threads)
+        for extension, threads in render_threads.items():
+            stop_stage(render_queues[extension], threads)
+        stop_stage(write_queue, write_threads)
+
+        if journal is not None:
+            journal.close()
+        if aborted.is_set():
+            print('Too many AttributeError, exiting...')
+            exit()
+
+    # Search flights with the engine chosen by --engine
+    def search_with_engine(ids, journal: Sweep_Journal = None):
+        if arg_dict['engine'] == 'pipeline':
+            search_flights_pipeline(ids, stage_workers=arg_dict['stage_workers'] or [workers, 1, 1, 1], journal=journal)
+        elif arg_dict['engine'] == 'async':
+            asyncio.run(search_flights_async(ids, concurrency=workers, journal=journal))
+        else:
+            search_flights(ids, workers=workers, journal=journal)
+
+    # Claim shards of a queue and sweep them until none is left
+    # The lease of the current shard is renewed in the background, and its journal lets a reclaimed shard resume
+    def run_shard_worker(queue_file: str):
+        shard_queue = Shard_Queue(queue_file)
+        worker_name = f'{socket.gethostname()}:{os.getpid()}'
+        while True:
+            shard = shard_queue.claim(worker_name)
+            if shard is None:
+                # Wait for shards with errors to cool down, other workers may take them first
+                next_retry = shard_queue.next_retry()
+                if next_retry is None:
+                    break
+                print(f'\nWaiting {max(0, next_retry - time.time()):.0f}s to retry a shard with errors')
+                time.sleep(max(0, next_retry - time.time()) + 1)
+                continue
+            start_num, end_num = shard
+            print(f'\nShard {start_num:08X}-{end_num:08X} claimed by {worker_name}')
+
+            stop_renewing = threading.Event()
+            def renew_lease():
+                while not stop_renewing.wait(SHARD_LEASE_SECONDS/3):
+                    if not shard_queue.renew(start_num, worker_name):
+                        print(f'  Lease of shard {start_num:08X} was lost')
+                        return
+            renewer = threading.Thread(target=renew_lease, daemon=True)
+            renewer.start()
+
+            journal_file = os.path.join(CHECKPOINT_DIR, f'r4_{start_num:08X}_{end_num:08X}.log')
+            journal = Sweep_Journal(journal_file, start_num, resume=True)
+            try:
+                search_with_engine(hex_range(start_num, end_num, journal, probe_cache), journal=journal)
+            finally:
+                stop_renewing.set()
+                renewer.join()
+            shard_queue.complete(start_num, worker_name, journal.counts)
+        print(f'\nNo shard left in "{queue_file}"')
+        print(shard_queue.progress_text())
+
+    # The command line of a worker: the same options, with -r10 QUEUE instead of -r4 and the queue options
+    def shard_worker_command(queue_file: str) -> list[str]:
+        worker_args = []
+        skip = 0
+        for arg in sys.argv[1:]:
+            if skip:
+                skip -= 1
+            elif arg == '-r4':
+                skip = 2
+            elif arg in ['--shard-queue', '--shard-size', '--spawn']:
+                skip = 1
+            elif not arg.startswith(('--shard-queue=', '--shard-size=', '--spawn=')):
+                worker_args.append(arg)
+        return [sys.executable, os.path.realpath(__file__), '-r10', queue_file] + worker_args
+
+    # Split a -r4 range into a queue, then work on it, or start K workers and report their progress
+    # Workers on other machines can join with -r10 QUEUE, if the queue is on shared storage
+    def coordinate_shards(queue_file: str, start_num: int, end_num: int, shard_size: int, spawn: int):
+        shard_queue = Shard_Queue(queue_file)
+        if shard_queue.create(start_num, end_num, max(1, shard_size)):
+            print(f'Split all {end_num - start_num} entries into shards of {max(1, shard_size)} in "{queue_file}"')
+        else:
+            print(f'Continuing the shards already in "{queue_file}"')
+        print(f'More workers can join with: python3 {os.path.basename(__file__)} -r10 {queue_file}')
+        if spawn <= 0:
+            run_shard_worker(queue_file)
+            return
+
+        # Each worker writes its output into its own log
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        command = shard_worker_command(queue_file)
+        processes = []
+        for i in range(spawn):
+            with open(os.path.join(CHECKPOINT_DIR, f'shard_worker_{i}.log'), 'w', encoding='utf-8') as log:
+                processes.append(subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT))
+        print(f'Started {spawn} workers, logs in "{CHECKPOINT_DIR}"')
+        last_report = time.monotonic()
+        while any(process.poll() is None for process in processes):
+            time.sleep(1)
+            if time.monotonic() - last_report >= SHARD_PROGRESS_SECONDS:
+                print(shard_queue.progress_text())
+                last_report = time.monotonic()
+        print(shard_queue.progress_text())
+
+    if shard_range is not None:
+        coordinate_shards(arg_dict['shard_queue'], *shard_range, shard_size=arg_dict['shard_size'], spawn=arg_dict['spawn'])
+    elif run_mode == SHARD_WORKER:
+        run_shard_worker(arg_dict['r10'])
+    elif run_mode in [SEARCH_FLIGHT_BY_REG, SEARCH_FLIGHT_BY_FLIGHT_ID, SEARCH_FLIGHT_BY_FLIGHT_IDS, RUN_FOR_A_RANGE]:
+        search_with_engine(ids, journal=sweep_journal)
+    elif run_mode == SEARCH_REG_IN_WINDOW and window_start and window_end:
+        search_reg_in_window(reg_id, int(window_start.timestamp()), int(window_end.timestamp()), s=s, headers=headers)
+    elif run_mode == RENDER_SAVED_RESPONSES:
+        rerender_responses(reg_ids, workers=arg_dict['workers'] or os.cpu_count() or 1)
+    elif run_mode == EXPORT_AGGREGATE:
+        export_aggregate(reg_ids, since=export_since, until=export_until)
     
     exit()